@@ -9,6 +9,7 @@ import json
 sys.path.append( "/etc/argon/" )
 from argonsysinfo import *
 from argonconfig import *
+from argonsnapshot import *
 from version import *
 import argparse
 from collections import ChainMap
@@ -88,15 +89,13 @@ def show_storage():
     """ Display the storage devices in the system.  These not, devices involved
     in a RAID array are NOT displayed, however the RAID device is.
     """
-    temp_result = {}
     result = {}
-    devices = argonsysinfo_listhddusage()
     values = []
-    for dev in devices:
-        values.append( {"Device": dev
-                    ,"Total": argonsysinfo_kbstr(devices[dev]['total'])
-                    ,"Used": argonsysinfo_kbstr(devices[dev]['used'])
-                    ,"Percent": f"{devices[dev]['percent']}"
+    for dev in collector.get('disks'):
+        values.append( {"Device": dev.name
+                    ,"Total": argonsysinfo_kbstr(dev.totalkb)
+                    ,"Used": argonsysinfo_kbstr(dev.usedkb)
+                    ,"Percent": f"{dev.percent}"
                     }
                   )
 
@@ -113,29 +112,19 @@ def show_raid():
     If software RAID is setup, report on the status of the RAID sets.  If there is
     no RAID setup, inform the user.
     """
-    raidList = argonsysinfo_listraid()['raidlist']
     values = []
     rebuildExists = False
     keys = ['Device', 'Type', 'Size', 'State' ]
-    for item in raidList:
-        stateArray = item['info']['state'].split(", ")
-        if len(stateArray) == 1:
-            state = stateArray[0]
-        elif len(stateArray) == 2:
-            state = stateArray[1]
-        elif len(stateArray) >= 3:
-            state = stateArray[2]
-        else:
-            state = None
-        raidDict = {'Device' : item['title']
-                   ,'Type'   : item['info']['raidtype'].upper()
-                   ,'Size'   : argonsysinfo_kbstr(item['info']['size'])
-                   ,'State'  : state.capitalize()
+    for item in collector.get('raid'):
+        raidDict = {'Device' : item.name
+                   ,'Type'   : item.level.upper()
+                   ,'Size'   : argonsysinfo_kbstr(item.sizekb)
+                   ,'State'  : item.status.capitalize()
                    ,'Rebuild': None
                    }
-        if len(item['info']['resync']) > 0:
+        if len(item.resync) > 0:
             rebuildExists = True
-            raidDict['Rebuild'] = item['info']['resync']
+            raidDict['Rebuild'] = item.resync
         values.append( raidDict )
 
     if rebuildExists:
@@ -156,7 +145,7 @@ def show_cpuUtilization():
     Display the current CPU utilization. Not all that helpful as it is simply a 
     snapshot, and tools such as htop etc work much better.
     """
-    values = [{'CPU': d['title'], "%": d["value"]} for d in argonsysinfo_listcpuusage()]
+    values = [{'CPU': d.name, "%": d.percent} for d in collector.get('cpu')]
 
     result = {}
     result['title'] = 'CPU Utilization:'
@@ -170,7 +159,7 @@ def show_cpuTemperature():
     """
     Display the current CPU temperature
     """
-    rawTemp = argonsysinfo_getcputemp()
+    rawTemp = collector.get('temperatures').cpu
     ctemp   = argonsysinfo_truncateFloat(rawTemp,2)
     ftemp   = argonsysinfo_convertCtoF(rawTemp,2)
 
@@ -186,13 +175,32 @@ def show_ipaddresses():
     Display a list of all Network interfaces configured with IP addresses, with the
     exception of any bridge types setup for containers
     """
-    values = [{"interface": item[0], 'ip':item[1]} for item in argonsysinfo_getipList()]
+    values = [{"interface": item.interface, 'ip':item.address} for item in collector.get('network')]
     result = {}
     result['title'] = 'IP Addresses:'
     result['values'] = values
     return result
 
 
+#
+def show_network():
+    """
+    Display the receive and transmit rates of the network interfaces.
+    """
+    values = []
+    for item in collector.get('throughput'):
+        values.append( {'interface' : item.interface,
+                        'Rx/Sec'    : argonsysinfo_kbstr(int(item.rxbytes/1024)),
+                        'Tx/Sec'    : argonsysinfo_kbstr(int(item.txbytes/1024)),
+                        'RxPkt/Sec' : int(item.rxpackets),
+                        'TxPkt/Sec' : int(item.txpackets)} )
+
+    result = {}
+    result['title'] = 'Network Throughput:'
+    result['values'] = values
+    return result
+
+
 #
 def show_hddTemperature():
     """
@@ -200,13 +208,11 @@ def show_hddTemperature():
     this includes the temperature for any NVME device, so you may need to modify your
     fan triggers
     """
-    hddTemp = argonsysinfo_gethddtemp()
     values = []
-    for item in hddTemp:
-        rawTemp = hddTemp[item]
-        ctemp   = argonsysinfo_truncateFloat(rawTemp,1)
-        ftemp   = argonsysinfo_convertCtoF(rawTemp,1)
-        values.append( {'device':item, "C":ctemp, "F":ftemp})
+    for item in collector.get('temperatures').drives:
+        ctemp   = argonsysinfo_truncateFloat(item.celsius,1)
+        ftemp   = argonsysinfo_convertCtoF(item.celsius,1)
+        values.append( {'device':item.name, "C":ctemp, "F":ftemp})
 
     result = {}
     result['title'] = 'Storage Temperature:'
@@ -214,6 +220,87 @@ def show_hddTemperature():
     return result
 
 
+#
+def show_nvmeHealth():
+    """
+    Display the SMART / Health log of any NVMe drives, read straight from the controller.
+    """
+    values = []
+    for controller in argonnvme_listcontrollers():
+        health = argonnvme_smartlog( controller )
+        if health is None:
+            continue
+        values.append( {'device'    : controller,
+                        'C'         : health.celsius,
+                        'spare'     : str(health.availablespare) + '%',
+                        'used'      : str(health.percentused) + '%',
+                        'hours'     : health.poweronhours,
+                        'unsafe'    : health.unsafeshutdowns,
+                        'errors'    : health.mediaerrors,
+                        'warning'   : hex(health.criticalwarning)} )
+
+    result = {}
+    result['title'] = 'NVMe Health:'
+    result['values'] = values
+    return result
+
+
+#
+def show_throttle():
+    """
+    Display whether the CPU is being throttled, the clock it is running at, and how many times and
+    for how long it has been throttled since the daemon started.
+    """
+    status = argonsysinfo_getthrottle()
+    result = {}
+    result['title'] = 'CPU Throttling:'
+    result['values'] = [{'state'   : status['state'],
+                         'MHz'     : status['freq'],
+                         'flags'   : hex(status['flags']),
+                         'events'  : status['count'],
+                         'seconds' : int(status['seconds'])}]
+    return result
+
+
+#
+def show_fanControl():
+    """
+    Display how the daemon is controlling the fan: the mode, how long until it next checks the
+    temperatures and why, and how fast they are rising.
+    """
+    values = []
+    status = argonsysinfo_getfancontrol()
+    if status is not None:
+        values.append( {'mode'     : status['mode'],
+                        'percent'  : status['speed'],
+                        'interval' : round(status['interval'],1),
+                        'reason'   : status['reason'],
+                        'C/min'    : round(status['rate'],1)} )
+
+    result = {}
+    result['title'] = 'Fan Control:'
+    result['values'] = values
+    return result
+
+
+#
+def show_throttleEvents():
+    """
+    Display the most recent throttling episodes.
+    """
+    values = []
+    for event in argonsysinfo_getthrottle()['events']:
+        values.append( {'start'    : time.strftime( "%Y-%m-%d %H:%M:%S", time.localtime( event['start'] ) ),
+                        'seconds'  : int(event['duration']),
+                        'minMHz'   : event['minfreq'],
+                        'reasons'  : " ".join( event['reasons'] )} )
+
+    result = {}
+    result['title'] = 'Throttling Events:'
+    result['values'] = values
+    return result
+
+
 #
 def show_fanspeed():
     """
@@ -229,25 +316,14 @@ def show_fanspeed():
 #
 def show_hddutilization():
     """
-    Display the current disk device utilization, this is basically useless, use dstat.
+    Display the current disk device utilization, along with the iostat style IOPS, average time
+    per I/O, queue depth and percent busy.
     """
-    start  = time.clock_gettime_ns(time.CLOCK_MONOTONIC)
-    usage1 = argonsysinfo_diskusage()
-    time.sleep(1)
-    usage2 = argonsysinfo_diskusage()
-    stop   = time.clock_gettime_ns(time.CLOCK_MONOTONIC)
-
-    for istop in usage2:
-        for istart in usage1:
-            if istop['disk'] == istart['disk']:
-                istart['readsector']  = istop['readsector'] - istart['readsector']
-                istart['writesector'] = istop['writesector'] - istart['writesector']
-    span = ((stop - start)/1000000000)
     values = []
-    for item in usage1:
-        readbw = (item['readsector']/2)/span
-        writebw = (item['writesector']/2)/span
-        values.append({'Device':item['disk'], "Read/Sec":argonsysinfo_kbstr(int(readbw)),"Write/Sec":argonsysinfo_kbstr(int(writebw))})
+    for item in collector.get('bandwidth'):
+        values.append({'Device':item.name, "Read/Sec":argonsysinfo_kbstr(int(item.readkb)),"Write/Sec":argonsysinfo_kbstr(int(item.writekb)),
+                       "IOPS":int(item.iops), "Await(ms)":argonsysinfo_truncateFloat(item.latency,1),
+                       "Queue":argonsysinfo_truncateFloat(item.queue,2), "Busy":str(int(item.busy))+'%'})
 
     result = {}
     result['title'] = 'Storage Utilization:'
@@ -278,11 +354,11 @@ def show_memory():
     """
     Display currnent memory utilization
     """
-    memory = argonsysinfo_getram()
+    memory = collector.get('memory')
 
     result = {}
     result['title'] = 'Memory:'
-    result['values'] = [{"Total GB":memory['gb'],"Free percent":memory['percent']}]
+    result['values'] = [{"Total GB":memory.gb,"Free percent":memory.percent}]
     return result
 
 #
@@ -306,12 +382,15 @@ def setup_arguments():
     parser.add_argument( '-i', '--ip',      action='store_true', help='Display currently configured IP addresses.')
     parser.add_argument( '-j', '--json',    action='store_true', help='Display output in json format')
     parser.add_argument( '-m', '--memory',  action='store_true', help='Display memory utilization on the EON.')
+    parser.add_argument( '-n', '--network', action='store_true', help='Display network throughput.')
     parser.add_argument( '-r', '--raid',    action='store_true', help='Display current state of the raid Array if it exists.')
     parser.add_argument( '-s', '--storage', action='store_true', help='Display information about the storage system.')
     parser.add_argument( '-t', '--temp',    action='store_true', help='Display information about the current temperature.')
     parser.add_argument( '-u', '--hdduse',  action='store_true', help='Display disk utilization.')
     parser.add_argument( '--hddtemp',       action='store_true', help='Display the temperature of the storage devices.')
+    parser.add_argument( '--nvme',          action='store_true', help='Display the health of any NVMe drives.')
     parser.add_argument( '--cooling',       action='store_true', help='Display cooling information about the EON.')
+    parser.add_argument( '--detail',        action='store_true', help='Use mdadm to obtain RAID details, instead of sysfs.')
     return parser
 
 def show_config():
@@ -322,8 +401,9 @@ def show_config():
     hddtempvalues = loadHDDFanConfig()
     cputempvalues = loadCPUFanConfig()
   
-    actualcpu = argonsysinfo_getcputemp()
-    actualhdd = argonsysinfo_getmaxhddtemp()
+    temperatures = collector.get('temperatures')
+    actualcpu = temperatures.cpu
+    actualhdd = temperatures.hddmax
     fanspeed  = argonsysinfo_getCurrentFanSpeed()
     keys = {}
     hdd = {'Temperature':'HDD fanspeed'}
@@ -376,6 +456,7 @@ def main():
     """
     global args
     global parser
+    global collector
 
     parser = setup_arguments()
     if len(sys.argv) > 1:
@@ -386,6 +467,8 @@ def main():
     else:
         args = parser.parse_args(['--devices','--ip'])
 
+    collector = SnapshotCollector( raiddetail = args.detail )
+
     if args.version :
         print_version()
     if args.cpu:
@@ -412,6 +495,9 @@ def main():
     if args.hddtemp:
         result = show_hddTemperature()
         printOutput(result)
+    if args.nvme:
+        result = show_nvmeHealth()
+        printOutput(result)
     if args.ip:
         result = show_ipaddresses()
         printOutput(result)
@@ -421,6 +507,9 @@ def main():
     if args.hdduse:
         result = show_hddutilization()
         printOutput(result)
+    if args.network:
+        result = show_network()
+        printOutput(result)
     if args.all:
         show_all_list = [
             "storage",
@@ -438,6 +527,9 @@ def main():
             "cpuTemperature",
             "hddTemperature",
             "fanspeed",
+            "fanControl",
+            "throttle",
+            "throttleEvents",
             "config"
             ]
         show_all(show_cooling_list)
@@ -36,6 +36,7 @@ if [ -f $argononefanscript ]; then
     /usr/bin/python3 $argononefanscript FANOFF
     # Remove files
     rm /lib/systemd/system/argononed.service
+    rm -rf /run/argoneon
 fi
 
 # Remove RTC if any
@@ -2,7 +2,11 @@
 # Configuration processing code
 #
 import os
+import time
+import threading
 import configparser
+from argonlogging import *
+from argonfan import *
 CONFIG_FILE='/etc/argoneon.conf'
 
 #
@@ -19,7 +23,7 @@ def setOLEDDefaults(config):
     if not 'screensaver' in config['OLED'].keys():
         config['OLED']['screensaver'] = '30'
     if not 'screenlist' in config['OLED'].keys():
-        config['OLED']['screenlist'] = 'clock cpu storage bandwidth raid ram temp ip'
+        config['OLED']['screenlist'] = 'clock cpu storage bandwidth network raid ram temp ip'
     if not 'enabled' in config['OLED'].keys():
         config['OLED']['enabled'] = 'Y'
 
@@ -38,7 +42,57 @@ def setGeneralDefaults(config):
         config['General']['debug'] = 'N'
 
 #
-def loadConfigAndDefaults():
+def setFanControlDefaults(config):
+    """
+    Setup the defaults for the FanControl section, the settings that apply to the fan as a whole
+    rather than to one temperature.  throttlespeed is the speed used as soon as the CPU is being
+    throttled, or is about to be (the CPU is at throttletemp or over).  curve is either step, to
+    use the speed of the highest temperature reached, or linear to move smoothly between them.
+    upband and downband (in degrees, or load percent) are how far past a threshold a reading has
+    to go before the fan speeds up or slows down, and updwell and downdwell how long (in seconds)
+    that has to last.  mode is curve to use the CPUFan and HDDFan tables, or pid to hold the CPU
+    and drives at cputarget and hddtarget using the gains kp, ki and kd, with the speed rounded
+    to a multiple of quantum.  The temperatures are checked every mininterval to maxinterval
+    seconds, depending on how fast they are changing.
+    """
+    if not 'FanControl' in config.keys():
+        config['FanControl'] = {}
+
+    if not 'throttlespeed' in config['FanControl'].keys():
+        config['FanControl']['throttlespeed'] = '100'
+    if not 'throttletemp' in config['FanControl'].keys():
+        config['FanControl']['throttletemp'] = '75.0'
+    if not 'curve' in config['FanControl'].keys():
+        config['FanControl']['curve'] = 'step'
+    if not 'upband' in config['FanControl'].keys():
+        config['FanControl']['upband'] = '0.0'
+    if not 'downband' in config['FanControl'].keys():
+        config['FanControl']['downband'] = '2.0'
+    if not 'updwell' in config['FanControl'].keys():
+        config['FanControl']['updwell'] = '0'
+    if not 'downdwell' in config['FanControl'].keys():
+        config['FanControl']['downdwell'] = '30'
+    if not 'mode' in config['FanControl'].keys():
+        config['FanControl']['mode'] = 'curve'
+    if not 'cputarget' in config['FanControl'].keys():
+        config['FanControl']['cputarget'] = '60.0'
+    if not 'hddtarget' in config['FanControl'].keys():
+        config['FanControl']['hddtarget'] = '42.0'
+    if not 'kp' in config['FanControl'].keys():
+        config['FanControl']['kp'] = '5.0'
+    if not 'ki' in config['FanControl'].keys():
+        config['FanControl']['ki'] = '0.1'
+    if not 'kd' in config['FanControl'].keys():
+        config['FanControl']['kd'] = '0.0'
+    if not 'quantum' in config['FanControl'].keys():
+        config['FanControl']['quantum'] = '5'
+    if not 'mininterval' in config['FanControl'].keys():
+        config['FanControl']['mininterval'] = '5'
+    if not 'maxinterval' in config['FanControl'].keys():
+        config['FanControl']['maxinterval'] = '180'
+
+#
+def loadConfigAndDefaults( path = CONFIG_FILE ):
     """
     Load up the configuration file.  We utilize a single config file, and for everything that is
     missing we setup default values for it.  This allows for one stop shopping for setting up the
@@ -48,9 +102,9 @@ def loadConfigAndDefaults():
 
     try:
         config = configparser.ConfigParser()
-        config.read( CONFIG_FILE )
+        config.read( path )
     except Exception as e:
-        logError( "Error processing configuration file " + CONFIG_FILE + "exception is " + e )
+        logError( "Error processing configuration file " + path + " exception is " + str(e) )
 
     #
     # Setup defaults for anything that is missing
@@ -63,45 +117,193 @@ def loadConfigAndDefaults():
         config['HDDFan'] = {'40.0':'25', '44.0':'30', '46.0':'35',
                             '48.0':'40', '50.0':'45', '50.0':'50',
                             '52.0':'55', '54.0':'60', '60.0':'100'}
+    if not 'LoadFan' in config.keys():
+        # Off unless asked for, so the fan behaves as it always has under load
+        config['LoadFan'] = {}
+    setFanControlDefaults( config )
  
-    if not os.path.exists( CONFIG_FILE ):
-        with open( CONFIG_FILE, 'w' ) as configfile:
+    if not os.path.exists( path ):
+        with open( path, 'w' ) as configfile:
             config.write(configfile)
 
     return config
 
+#
+class ArgonConfig:
+    """
+    The configuration, parsed once and shared by the whole process.  Every access does a cheap
+    check (at most once every checkinterval seconds) of the inode, modification time and size of
+    the file, and the file is only parsed again when one of them has changed.  generation goes up
+    by one every time the file is parsed, so long running code can tell when to pick up changes.
+
+    The typed getters return a value of the right type, falling back to the default for a setting
+    that is missing or cannot be converted.
+    """
+    def __init__( self, path = CONFIG_FILE, checkinterval = 1 ):
+        self.path          = path
+        self.checkinterval = checkinterval
+        self.lock          = threading.Lock()
+        self.config        = None
+        self.signature     = None
+        self.checked       = 0
+        self.generation    = 0
+        self.curves        = {}
+        self.defaults      = configparser.ConfigParser()
+        setGeneralDefaults( self.defaults )
+        setOLEDDefaults( self.defaults )
+        setFanControlDefaults( self.defaults )
+
+    def stat( self ):
+        try:
+            st = os.stat( self.path )
+            return (st.st_ino, st.st_mtime_ns, st.st_size)
+        except OSError:
+            return None
+
+    def get( self ):
+        """ Return the ConfigParser, reloading it if the file has changed """
+        with self.lock:
+            now = time.monotonic()
+            if self.config is None or now - self.checked >= self.checkinterval:
+                self.checked = now
+                signature = self.stat()
+                if self.config is None or signature != self.signature:
+                    self.config     = loadConfigAndDefaults( self.path )
+                    # Loading creates the file if it was missing
+                    self.signature  = self.stat()
+                    self.curves     = {}
+                    self.generation += 1
+            return self.config
+
+    def section( self, name ):
+        return self.get()[name]
+
+    def getstr( self, section, key ):
+        config = self.get()
+        if config.has_option( section, key ):
+            return config[section][key].replace( "\"", "" ).strip()
+        return self.defaults.get( section, key, fallback = "" )
+
+    def getint( self, section, key ):
+        try:
+            return int( float( self.getstr( section, key ) ) )
+        except ValueError:
+            logError( "Invalid value for " + key + " in the " + section + " section of " + self.path )
+            return int( float( self.defaults.get( section, key, fallback = "0" ) ) )
+
+    def getfloat( self, section, key ):
+        try:
+            return float( self.getstr( section, key ) )
+        except ValueError:
+            logError( "Invalid value for " + key + " in the " + section + " section of " + self.path )
+            return float( self.defaults.get( section, key, fallback = "0" ) )
+
+    def getbool( self, section, key ):
+        """ Settings use Y for yes, anything else is no """
+        return self.getstr( section, key ).upper() == 'Y'
+
+    def getlist( self, section, key ):
+        return self.getstr( section, key ).split()
+
+    def curve( self, section ):
+        """ Return a fan section (CPUFan, HDDFan ...) as a tuple of (threshold, speed) pairs in
+        increasing order of threshold.  Entries that are not numbers are logged and left out, and
+        speeds are kept within 0-100.
+        """
+        config = self.get()
+        with self.lock:
+            if section not in self.curves:
+                points = []
+                if config.has_section( section ):
+                    for key, value in config[section].items():
+                        try:
+                            points.append( (float(key), max( 0, min( 100, int(float(value)) ) )) )
+                        except ValueError:
+                            logError( "Ignoring " + key + " = " + value + " in the " + section + " section of " + self.path )
+                self.curves[section] = tuple( sorted( points ) )
+            return self.curves[section]
+
+    def fancurves( self ):
+        """ Return the CPUFan, HDDFan and LoadFan sections compiled into FanCurves, done once each
+        time the file is loaded.
+        """
+        config = self.get()
+        if 'compiled' not in self.curves:
+            mode = self.getstr( 'FanControl', 'curve' ).lower()
+            if mode not in ('step', 'linear'):
+                logError( "Unknown fan curve " + mode + " in the FanControl section of " + self.path + ", using step" )
+            interpolate = mode == 'linear'
+            compiled = FanCurves( FanCurve( self.curve( 'CPUFan' ), interpolate ),
+                                  FanCurve( self.curve( 'HDDFan' ), interpolate ),
+                                  FanCurve( self.curve( 'LoadFan' ), interpolate ) )
+            with self.lock:
+                self.curves['compiled'] = compiled
+        return self.curves['compiled']
+
+    def fancontrol( self ):
+        """ Return the hysteresis settings from the FanControl section """
+        return FanControlSettings( max( 0.0, self.getfloat( 'FanControl', 'upband' ) ),
+                                   max( 0.0, self.getfloat( 'FanControl', 'downband' ) ),
+                                   max( 0.0, self.getfloat( 'FanControl', 'updwell' ) ),
+                                   max( 0.0, self.getfloat( 'FanControl', 'downdwell' ) ) )
+
+    def fanintervals( self ):
+        """ Return the shortest and longest wait (in seconds) between fan checks.  The longest is
+        kept to FAN_MAXINTERVAL, so argon-status never takes the daemon's published state as stale.
+        """
+        mininterval = max( 1.0, self.getfloat( 'FanControl', 'mininterval' ) )
+        return (mininterval, min( FAN_MAXINTERVAL, max( mininterval, self.getfloat( 'FanControl', 'maxinterval' ) ) ))
+
+    def fanmode( self ):
+        """ Return the fan control mode, curve or pid """
+        mode = self.getstr( 'FanControl', 'mode' ).lower()
+        if mode not in ('curve', 'pid'):
+            logError( "Unknown fan control mode " + mode + " in the FanControl section of " + self.path + ", using curve" )
+            return 'curve'
+        return mode
+
+    def fanpid( self ):
+        """ Return the PID settings from the FanControl section """
+        return FanPIDSettings( self.getfloat( 'FanControl', 'cputarget' ),
+                               self.getfloat( 'FanControl', 'hddtarget' ),
+                               self.getfloat( 'FanControl', 'kp' ),
+                               self.getfloat( 'FanControl', 'ki' ),
+                               self.getfloat( 'FanControl', 'kd' ),
+                               self.getint( 'FanControl', 'quantum' ) )
+
+#
+# The configuration for this process
+#
+currentconfig = ArgonConfig()
+
 #
 def loadCPUFanConfig():
     """
-    Load the main configuration and return just the CPUFan portion.  Instead of loading once, and
-    then pulling the CPU configuration out, we load everytime there is a call, this allos us to read
-    in a new file if here is a change.
+    Return the CPUFan portion of the configuration.  The configuration is only read again when the
+    file changes, so changes are still picked up without a restart.
     """
-    return loadConfigAndDefaults()['CPUFan']
+    return currentconfig.section('CPUFan')
 
 #
 def loadHDDFanConfig():
     """
-    Load the main configuration and reutrn just the HDDFan portion.  Instead of loading once, and
-    then pulling the HDD configuraiton out, we can load everytime there is a call.  This will allow us
-    to read in changes if they user does so.
+    Return the HDDFan portion of the configuration.
     """
-    return loadConfigAndDefaults()['HDDFan']
+    return currentconfig.section('HDDFan')
 
 #
 def loadOLEDConfig():
     """
     Obtain the OLED configuration info, and return it.
     """
-    config = loadConfigAndDefaults()['OLED']
-    return config;
+    return currentconfig.section('OLED')
 
 #
 def loadTempConfig():
     """
     Return the value we are supposed to be using for temperature, either Celcius, or Fahrenheit.
     """
-    return loadConfigAndDefaults()['General']['temperature']
+    return currentconfig.getstr('General', 'temperature')
 
 #
 def loadDebugMode():
@@ -109,6 +311,4 @@ def loadDebugMode():
     Return the value of the debugging setting.  'Y' is used to enable debug, Anything else is
     no debugging
     """
-    if loadConfigAndDefaults()['General']['debug'] == 'Y':
-        return True
-    return False
+    return currentconfig.getbool('General', 'debug')
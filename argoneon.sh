@@ -168,8 +168,30 @@ sudo curl -L $ARGONDOWNLOADSERVER/argonsysinfo.py -o $INSTALLATIONFOLDER/argonsy
 sudo chmod 755 $INSTALLATIONFOLDER/argonsysinfo.py
 sudo curl -L $ARGONDOWNLOADSERVER/argonconfig.py -o $INSTALLATIONFOLDER/argonconfig.py --silent
 sudo chmod 755 $INSTALLATIONFOLDER/argonconfig.py
+sudo curl -L $ARGONDOWNLOADSERVER/argonfan.py -o $INSTALLATIONFOLDER/argonfan.py --silent
+sudo chmod 755 $INSTALLATIONFOLDER/argonfan.py
 sudo curl -L $ARGONDOWNLOADSERVER/argonlogging.py -o $INSTALLATIONFOLDER/argonlogging.py --silent
 sudo chmod 755 $INSTALLATIONFOLDER/argonlogging.py
+sudo curl -L $ARGONDOWNLOADSERVER/argonprocfs.py -o $INSTALLATIONFOLDER/argonprocfs.py --silent
+sudo chmod 755 $INSTALLATIONFOLDER/argonprocfs.py
+sudo curl -L $ARGONDOWNLOADSERVER/argonrates.py -o $INSTALLATIONFOLDER/argonrates.py --silent
+sudo chmod 755 $INSTALLATIONFOLDER/argonrates.py
+sudo curl -L $ARGONDOWNLOADSERVER/argonparse.py -o $INSTALLATIONFOLDER/argonparse.py --silent
+sudo chmod 755 $INSTALLATIONFOLDER/argonparse.py
+sudo curl -L $ARGONDOWNLOADSERVER/argonhddtemp.py -o $INSTALLATIONFOLDER/argonhddtemp.py --silent
+sudo chmod 755 $INSTALLATIONFOLDER/argonhddtemp.py
+sudo curl -L $ARGONDOWNLOADSERVER/argonload.py -o $INSTALLATIONFOLDER/argonload.py --silent
+sudo chmod 755 $INSTALLATIONFOLDER/argonload.py
+sudo curl -L $ARGONDOWNLOADSERVER/argoninventory.py -o $INSTALLATIONFOLDER/argoninventory.py --silent
+sudo chmod 755 $INSTALLATIONFOLDER/argoninventory.py
+sudo curl -L $ARGONDOWNLOADSERVER/argonnetlink.py -o $INSTALLATIONFOLDER/argonnetlink.py --silent
+sudo chmod 755 $INSTALLATIONFOLDER/argonnetlink.py
+sudo curl -L $ARGONDOWNLOADSERVER/argonnvme.py -o $INSTALLATIONFOLDER/argonnvme.py --silent
+sudo chmod 755 $INSTALLATIONFOLDER/argonnvme.py
+sudo curl -L $ARGONDOWNLOADSERVER/argonsnapshot.py -o $INSTALLATIONFOLDER/argonsnapshot.py --silent
+sudo chmod 755 $INSTALLATIONFOLDER/argonsnapshot.py
+sudo curl -L $ARGONDOWNLOADSERVER/argonthrottle.py -o $INSTALLATIONFOLDER/argonthrottle.py --silent
+sudo chmod 755 $INSTALLATIONFOLDER/argonthrottle.py
 sudo curl -L $ARGONDOWNLOADSERVER/version.py -o $INSTALLATIONFOLDER/version.py --silent
 sudo chmod 755 $INSTALLATIONFOLDER/version.py
 
@@ -0,0 +1,300 @@
+#!/usr/bin/python3
+
+#
+# Fan curves.
+#
+# The CPUFan, HDDFan and LoadFan sections of the configuration map a threshold to a fan speed.
+# Rather than walking the section's strings on every fan check, each section is compiled once,
+# when the configuration is loaded, into two sorted arrays, and a reading is looked up with a
+# binary search.  A curve can either step (the speed of the highest threshold reached, as the
+# tables always have) or interpolate linearly between the points.
+#
+# The FanController then decides when the fan actually moves to the speed the curves ask for.
+# Alternatively FanPID drives the fan from how far the temperatures are from a target, as a
+# closed loop.  Either way, FanSchedule decides how soon the temperatures need looking at again.
+#
+
+import math
+from array import array
+from bisect import bisect_right
+from typing import NamedTuple
+
+#
+class FanCurve:
+    """
+    A compiled fan curve.  points is a sequence of (threshold, speed) pairs, in any order.  Below
+    the first threshold the speed is 0, and from the last threshold on it is the last speed.
+    """
+    __slots__ = ('thresholds', 'speeds', 'interpolate')
+
+    def __init__( self, points, interpolate = False ):
+        points = sorted( points )
+        self.thresholds  = array( 'd', [p[0] for p in points] )
+        self.speeds      = array( 'i', [p[1] for p in points] )
+        self.interpolate = interpolate
+
+    def __len__( self ):
+        return len(self.thresholds)
+
+    def speed( self, value ):
+        """ The fan speed for a reading, in O(log n) with nothing allocated for the search """
+        i = bisect_right( self.thresholds, value )
+        if i == 0:
+            return 0
+        if self.interpolate and i < len(self.thresholds):
+            low  = self.thresholds[i-1]
+            span = self.thresholds[i] - low
+            return int( self.speeds[i-1] + (self.speeds[i] - self.speeds[i-1])*(value - low)/span )
+        return self.speeds[i-1]
+
+    def distance( self, value ):
+        """ How far a reading is from the threshold below it and the threshold above it, as
+        (below, above), either of which is infinite if there is no such threshold.
+        """
+        i = bisect_right( self.thresholds, value )
+        below = value - self.thresholds[i-1] if i > 0 else math.inf
+        above = self.thresholds[i] - value if i < len(self.thresholds) else math.inf
+        return (below, above)
+
+#
+class FanCurves:
+    """
+    The CPU, HDD and load curves together, so all three readings are looked up in one call.
+    """
+    __slots__ = ('cpu', 'hdd', 'load')
+
+    def __init__( self, cpu, hdd, load ):
+        self.cpu  = cpu
+        self.hdd  = hdd
+        self.load = load
+
+    def speeds( self, cputemp, hddtemp, load = 0 ):
+        """ Return the speed each curve asks for, as (cpu, hdd, load) """
+        return (self.cpu.speed( cputemp ), self.hdd.speed( hddtemp ), self.load.speed( load ))
+
+#
+class FanControlSettings(NamedTuple):
+    upband    : float    # how far past a threshold a reading must go before the fan speeds up
+    downband  : float    # how far back below a threshold a reading must drop before it slows
+    updwell   : float    # seconds a speed up has to be called for before it happens
+    downdwell : float    # seconds a slow down has to be called for before it happens
+
+#
+class FanController:
+    """
+    Decides when the fan speed actually changes, as a timed state machine rather than by sleeping.
+    The fan speeds up once a reading passes a threshold by upband, and slows down only once the
+    readings are downband below the threshold, so it does not flap on a reading sitting right at a
+    threshold.  Each change also has to be asked for continuously for its dwell time.  While a
+    change is waiting (pending), the caller should keep sampling, so that a rising temperature
+    cancels a slow down straight away.
+    """
+    def __init__( self ):
+        self.rising  = None    # time.monotonic() a speed up was first asked for
+        self.falling = None    # time.monotonic() a slow down was first asked for
+
+    @property
+    def pending( self ):
+        return self.rising is not None or self.falling is not None
+
+    def update( self, curves, settings, current, now, cputemp, hddtemp, load = 0 ):
+        """ Return the speed the fan should be running at now, given the current speed """
+        up = max( curves.speeds( cputemp - settings.upband, hddtemp - settings.upband, load - settings.upband ) )
+        if up > current:
+            self.falling = None
+            if self.rising is None:
+                self.rising = now
+            if now - self.rising >= settings.updwell:
+                self.rising = None
+                return up
+            return current
+        self.rising = None
+
+        down = max( curves.speeds( cputemp + settings.downband, hddtemp + settings.downband, load + settings.downband ) )
+        if down < current:
+            if self.falling is None:
+                self.falling = now
+            if now - self.falling >= settings.downdwell:
+                self.falling = None
+                return down
+            return current
+        self.falling = None
+        return current
+
+#
+class FanPIDSettings(NamedTuple):
+    cputarget : float    # the temperatures the loops aim for
+    hddtarget : float
+    kp        : float    # percent of fan per degree over the target
+    ki        : float    # percent of fan per degree second over the target
+    kd        : float    # percent of fan per degree per second of rise
+    quantum   : int      # the output is rounded to a multiple of this
+
+#
+class PIDLoop:
+    """
+    One PID loop, holding one temperature at its target.  The integral is only allowed to grow
+    while the output is not already pinned at 0 or 100% in the same direction (anti-windup by
+    conditional integration), so the loop does not overshoot after a long spell at full speed.
+    A loop that misses ticks has to be restart()ed, or the whole gap is integrated in one go.
+    """
+    def __init__( self ):
+        self.integral  = 0.0
+        self.lasterror = None
+        self.stamp     = None
+
+    def restart( self ):
+        """ Forget when the loop last ran, so the next update integrates nothing """
+        self.lasterror = None
+        self.stamp     = None
+
+    def update( self, temp, target, kp, ki, kd, now ):
+        error = temp - target
+        span  = 0
+        if self.stamp is not None:
+            span = now - self.stamp
+        derivative = 0.0
+        if span > 0 and self.lasterror is not None:
+            derivative = kd*(error - self.lasterror)/span
+
+        integral = self.integral + ki*error*span
+        output   = kp*error + integral + derivative
+        if not ((output > 100 and error > 0) or (output < 0 and error < 0)):
+            self.integral = max( 0.0, min( 100.0, integral ) )
+        self.lasterror = error
+        self.stamp     = now
+        return max( 0.0, min( 100.0, kp*error + self.integral + derivative ) )
+
+#
+class FanPID:
+    """
+    Closed loop fan control, one loop for the CPU and one for the hottest drive, the fan running
+    at whatever the more demanding loop asks for.  The output is quantized so small wobbles in
+    temperature do not turn into a write to the fan on every sample.
+    """
+    def __init__( self ):
+        self.cpu = PIDLoop()
+        self.hdd = PIDLoop()
+
+    def restart( self ):
+        """ Called whenever the loops are not run, such as while another fan mode is in use """
+        self.cpu.restart()
+        self.hdd.restart()
+
+    def update( self, settings, now, cputemp, hddtemp ):
+        output = self.cpu.update( cputemp, settings.cputarget, settings.kp, settings.ki, settings.kd, now )
+        if hddtemp > 0:
+            output = max( output, self.hdd.update( hddtemp, settings.hddtarget, settings.kp, settings.ki, settings.kd, now ) )
+        else:
+            # No drives reporting gives a temperature of 0, which is nothing to control
+            self.hdd.restart()
+        quantum = max( 1, settings.quantum )
+        return min( 100, quantum*int( (output + quantum/2)//quantum ) )
+
+#
+# How close (in degrees) below its next threshold a rising reading counts as near it, and how far
+# the CPU has to warm up since the last check to be worth waking the fan thread for.
+#
+THRESHOLD_BAND = 2.0
+WAKE_RISE      = 2.0
+
+#
+# The longest maxinterval may be set to, in seconds
+#
+FAN_MAXINTERVAL = 900.0
+
+#
+class FanSchedule:
+    """
+    Works out how long the fan thread can wait before its next check, between mininterval and
+    maxinterval seconds.  It checks again soon while a rising reading is near the next threshold up
+    (a steady reading sitting near a threshold needs no attention), or while something is pending (a slow down waiting out its dwell, or the PID loops, which need a steady
+    tick).  While a temperature is rising, the wait is half the time it would take at the current
+    rate to reach the next threshold.  Otherwise the wait doubles on every check, so an idle,
+    stable system is only looked at every few minutes.  A sudden rise in between is caught by
+    wake(), and load that would raise the LoadFan speed by wakeload(), given readings from
+    something that samples more often anyway.
+    """
+    def __init__( self ):
+        self.cputemp  = None
+        self.hddtemp  = None
+        self.load     = None
+        self.stamp    = None
+        self.rate     = 0.0      # degrees per minute, of whichever temperature is rising faster
+        self.interval = None
+        self.reason   = "start"
+
+    def next( self, curves, mininterval, maxinterval, now, cputemp, hddtemp, load = 0, pending = False ):
+        """ Return the number of seconds to wait until the next check """
+        rate = 0.0
+        near = math.inf
+        if self.stamp is not None and now > self.stamp:
+            rate = 60*max( cputemp - self.cputemp, hddtemp - self.hddtemp )/(now - self.stamp)
+            # How close each reading that went up since the last check is to its next threshold
+            for curve, reading, previous in ((curves.cpu, cputemp, self.cputemp), (curves.hdd, hddtemp, self.hddtemp),
+                                             (curves.load, load, self.load)):
+                if reading > previous:
+                    near = min( near, curve.distance( reading )[1] )
+        self.cputemp = cputemp
+        self.hddtemp = hddtemp
+        self.load    = load
+        self.stamp   = now
+        self.rate    = rate
+
+        cpuabove = curves.cpu.distance( cputemp )[1]
+        hddabove = curves.hdd.distance( hddtemp )[1]
+        if pending:
+            interval, reason = mininterval, "pending"
+        elif near <= THRESHOLD_BAND:
+            interval, reason = mininterval, "threshold"
+        elif rate > 0 and min( cpuabove, hddabove ) < math.inf:
+            interval, reason = 30*min( cpuabove, hddabove )/rate, "rising"
+        else:
+            interval, reason = 2*(self.interval or mininterval), "stable"
+        self.interval = max( mininterval, min( maxinterval, interval ) )
+        self.reason   = reason
+        return self.interval
+
+    def wake( self, cputemp ):
+        """ Whether the CPU has warmed up enough since the last check to check again now """
+        return self.cputemp is not None and cputemp - self.cputemp >= WAKE_RISE
+
+    def wakeload( self, curves, load ):
+        """ Whether the load has gone up enough since the last check to raise the LoadFan speed """
+        return self.load is not None and curves.load.speed( load ) > curves.load.speed( self.load )
+
+    def status( self ):
+        """ The last decision, as a dictionary that can be published """
+        return {'interval': self.interval, 'reason': self.reason, 'rate': self.rate}
+
+#
+# Microbenchmark comparing the compiled curve to walking the configuration section, the way
+# get_fanspeed() used to.  Run this file directly to use it.
+#
+def walk_section( tempval, configlist ):
+    """ The lookup the compiled curves replaced, kept only for the benchmark below.
+    """
+    retval = 0
+    for k in configlist.keys():
+        if tempval >= float(k):
+            retval = int(configlist[k])
+    return retval
+
+if __name__ == "__main__":
+    import timeit
+
+    print( f"{'points':<8}{'walk (us)':>12}{'step (us)':>12}{'linear (us)':>14}{'speedup':>10}" )
+    for count in [3, 9, 32, 128]:
+        section = {str(40.0 + i*60/count): str(int(25 + i*75/count)) for i in range(count)}
+        points  = [(float(k), int(v)) for k, v in section.items()]
+        step    = FanCurve( points )
+        linear  = FanCurve( points, interpolate = True )
+        for reading in [20.0, 55.5, 99.0]:
+            assert step.speed( reading ) == walk_section( reading, section )
+        readings = [30.0 + i*0.37 for i in range(200)]
+        number   = 200
+        walk     = timeit.timeit( lambda: [walk_section(r, section) for r in readings], number = number )
+        stepped  = timeit.timeit( lambda: [step.speed(r) for r in readings], number = number )
+        lineared = timeit.timeit( lambda: [linear.speed(r) for r in readings], number = number )
+        per      = number*len(readings)
+        print( f"{count:<8}{walk*1e6/per:>12.3f}{stepped*1e6/per:>12.3f}{lineared*1e6/per:>14.3f}{walk/stepped:>9.1f}x" )
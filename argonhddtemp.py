@@ -0,0 +1,277 @@
+#!/usr/bin/python3
+
+#
+# Drive temperature collection.
+#
+# Drives covered by the kernel drivetemp driver are read from their hwmon node.  For the rest we
+# use smartctl, which is slow (hundreds of milliseconds per drive, more if a drive has to wake up),
+# so those drives are probed concurrently on a small worker pool.  Either way the results are kept
+# in a per device cache that every consumer (fan thread, OLED, argon-status) shares.  NVMe drives
+# are read from their own hwmon node, see argonnvme.
+#
+# Drives that are not doing any I/O are polled less and less often, and drives that have spun down
+# are not polled at all until they do I/O again, so we never keep a sleeping NAS drive awake.
+#
+
+import os
+import time
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from argonprocfs import *
+from argonnvme import *
+
+SMARTCTL = "/usr/sbin/smartctl"
+
+#
+# Ways of asking smartctl for the attributes, in the order we try them.  Most drives in the EON sit
+# behind a USB/SATA bridge and need "-d sat", anything else gets smartctl's own detection.
+#
+PROBE_MODES = [["-d", "sat"], []]
+
+#
+# What a probe returns for a drive that is spun down
+#
+STANDBY = "standby"
+
+#
+# The longest we leave an idle drive between polls, in seconds.  This has to stay below the age at
+# which a reading stops counting towards the fan speed (HDDTEMP_MAXAGE), or an idle drive that is
+# still spinning would keep dropping in and out of the fan decisions.
+#
+IDLE_MAXTTL = 480
+
+#
+def argonhddtemp_needsudo():
+    """
+    smartctl needs root, if we are not running as root (or under sudo) we prefix it with sudo.
+    """
+    return not ('SUDO_UID' in os.environ) and os.geteuid() != 0
+
+#
+def argonhddtemp_listdisks():
+    """
+    Return the names of the SATA/IDE disks in the system, from /sys/block.
+    """
+    try:
+        return sorted( [d for d in os.listdir("/sys/block") if d[0:2] == "sd" or d[0:2] == "hd"] )
+    except OSError:
+        return []
+
+#
+def argonhddtemp_maphwmon():
+    """
+    Find the hwmon nodes registered by the drivetemp driver, and map them to the block device of
+    the drive.  Returns a dictionary of device name to the temp1_input path.
+    """
+    output = {}
+    try:
+        hwmonlist = os.listdir("/sys/class/hwmon")
+    except OSError:
+        return output
+    for hwmon in hwmonlist:
+        path = "/sys/class/hwmon/" + hwmon
+        try:
+            with open(path + "/name") as namefile:
+                if namefile.read().strip() != "drivetemp":
+                    continue
+            # The hwmon device is the SCSI device, the disk hangs off of it
+            for device in os.listdir(path + "/device/block"):
+                output[device] = path + "/temp1_input"
+        except OSError:
+            ...
+    return output
+
+#
+def argonhddtemp_readhwmon( path ):
+    """
+    Read a temperature from a hwmon node, returning None if it cannot be read.
+    """
+    try:
+        return argonprocfs_reader( path ).readint() / 1000
+    except (OSError, ValueError):
+        return None
+
+#
+def argonhddtemp_parsesmart( smartctlOutRaw ):
+    """
+    Pull the temperature out of the output of smartctl -A.  Attribute 194 (or 190) is used for
+    ATA drives, "Temperature:" for anything else.  Returns None if there is no temperature.
+    """
+    if 'scsi error unsupported scsi opcode' in smartctlOutRaw:
+        return None
+
+    smartctlOut = [l for l in smartctlOutRaw.split('\n') if l]
+
+    for smartAttr in ["194","190"]:
+        for line in smartctlOut:
+            if line.startswith(smartAttr):
+                parts = line.split()
+                try:
+                    return float(parts[9])
+                except (IndexError, ValueError):
+                    ## Smart Attr not usable
+                    ...
+
+    for line in smartctlOut:
+        if line.startswith("Temperature:"):
+            parts = line.split()
+            try:
+                return float(parts[1])
+            except (IndexError, ValueError):
+                ## Smart attribute not usable
+                ...
+    return None
+
+#
+class SmartTempService:
+    """
+    Shared drive temperatures, kept in a TTL cache.  A refresh reads every stale drive, from its
+    drivetemp hwmon node if it has one (reading it can reset a drive's spin down timer, so it is
+    not read any more often than smartctl would be), and otherwise with smartctl.  The smartctl
+    polls run concurrently on a bounded worker pool, and only one refresh runs at a time; anyone
+    asking while it runs waits for it and then gets the same results.  The probe mode that worked
+    for a drive is remembered so the next round only runs smartctl once for that drive.  NVMe
+    drives are read from sysfs every time.
+
+    If iocounters is given (a callable returning a dictionary of device name to a count of I/Os
+    completed) the polling follows the drive's activity.  A drive that has done no I/O since it was
+    last polled is idle, so its interval doubles each time up to maxttl, and a drive found in
+    standby is left alone until it does I/O again.  Either way the last temperature read is kept,
+    along with its age, so a sleeping drive does not drop out of the results.
+    """
+    def __init__( self, ttl = 60, workers = 4, onupdate = None, listdisks = argonhddtemp_listdisks,
+                  iocounters = None, maxttl = IDLE_MAXTTL ):
+        self.ttl        = ttl
+        self.maxttl     = max( ttl, maxttl )
+        self.workers    = workers
+        self.onupdate   = onupdate
+        self.listdisks  = listdisks
+        self.iocounters = iocounters
+        self.cache      = {}      # device -> (time read, temperature)
+        self.polled     = {}      # device -> (time polled, I/O count then, interval until the next poll)
+        self.modes      = {}
+        self.published  = 0
+        self.lock       = threading.Lock()
+        self.sudo       = argonhddtemp_needsudo()
+        self.devices    = listdisks()
+        self.hwmon      = argonhddtemp_maphwmon()
+        self.nvme       = argonnvme_maphwmon()
+
+    def smartctl( self, device, mode ):
+        cmd = [SMARTCTL] + mode + ["-n", "standby,0", "-A", "/dev/" + device]
+        if self.sudo:
+            cmd = ["sudo"] + cmd
+        try:
+            result = subprocess.run( cmd, stdout = subprocess.PIPE, stderr = subprocess.DEVNULL,
+                                     universal_newlines = True, timeout = 30 )
+        except (OSError, subprocess.SubprocessError):
+            return None
+        if "STANDBY" in result.stdout:
+            # smartctl noticed the drive was spun down and did not wake it
+            return STANDBY
+        return argonhddtemp_parsesmart( result.stdout )
+
+    def probe( self, device ):
+        """ Read the temperature of one device, trying the remembered probe mode first.  Returns
+        STANDBY if the drive is spun down.
+        """
+        known = self.modes.get( device )
+        modes = PROBE_MODES
+        if known is not None:
+            modes = [known] + [m for m in PROBE_MODES if m != known]
+        for mode in modes:
+            theTemp = self.smartctl( device, mode )
+            if theTemp:
+                self.modes[device] = mode
+                return theTemp
+        return None
+
+    def due( self, device, now, counts ):
+        """ True if a drive should be polled now.  Any I/O since the last poll puts the drive back
+        on the normal TTL.
+        """
+        if device not in self.polled:
+            return True
+        stamp, count, interval = self.polled[device]
+        if count is None or counts.get( device ) != count:
+            interval = self.ttl
+        return now - stamp >= interval
+
+    def refresh( self, devices ):
+        counts = {}
+        if self.iocounters is not None:
+            counts = self.iocounters()
+        now = time.monotonic()
+        stale = [d for d in devices if self.due( d, now, counts )]
+        if len(stale) == 0:
+            return False
+        results = {}
+        smartstale = []
+        for device in stale:
+            theTemp = None
+            if device in self.hwmon:
+                # Read here rather than on the pool, the persistent readers belong to this thread
+                theTemp = argonhddtemp_readhwmon( self.hwmon[device] )
+            if theTemp:
+                results[device] = theTemp
+            else:
+                smartstale.append( device )
+        if len(smartstale) > 0 and os.path.exists( SMARTCTL ):
+            with ThreadPoolExecutor( max_workers = min(self.workers, len(smartstale)) ) as pool:
+                results.update( zip( smartstale, pool.map( self.probe, smartstale ) ) )
+        now = time.monotonic()
+        for device in stale:
+            theTemp = results.get( device )
+            count = counts.get( device )
+            interval = self.ttl
+            if count is not None and device in self.polled and self.polled[device][1] == count:
+                interval = min( self.polled[device][2] * 2, self.maxttl )
+            if theTemp is STANDBY:
+                # Nothing to see until it spins up again, which will show in its counters
+                if count is not None:
+                    interval = self.maxttl
+            elif theTemp:
+                self.cache[device] = (now, theTemp)
+            self.polled[device] = (now, count, interval)
+        return True
+
+    def readings( self ):
+        """ Return a dictionary of device name to (temperature in C, age in seconds) for every
+        drive that has reported a temperature, refreshing any drives that are due.
+        """
+        with self.lock:
+            devices = self.listdisks()
+            if devices != self.devices or argonnvme_listcontrollers() != list( self.nvme ):
+                # Drives came or went, the hwmon numbering may have changed
+                self.devices = devices
+                self.hwmon   = argonhddtemp_maphwmon()
+                self.nvme    = argonnvme_maphwmon()
+                for cache in (self.cache, self.polled):
+                    for gone in [d for d in cache if d not in devices]:
+                        del cache[gone]
+
+            output = {}
+            updated = self.refresh( devices )
+            now = time.monotonic()
+            for device in devices:
+                if device in self.cache:
+                    stamp, theTemp = self.cache[device]
+                    output[device] = (theTemp, int(now - stamp))
+            for controller, theTemp in argonnvme_temperatures( self.nvme ).items():
+                output[controller] = (theTemp, 0)
+            output = {device: output[device] for device in devices + list(self.nvme) if device in output}
+            # Pass the results on even while every drive is idle, so they do not go stale
+            publish = updated or time.monotonic() - self.published >= self.ttl
+            if publish:
+                self.published = time.monotonic()
+        if publish and self.onupdate is not None:
+            self.onupdate( output )
+        return output
+
+    def temperatures( self ):
+        """ Return a dictionary of device name to temperature (in C) for every drive that has
+        reported one.  A drive that is asleep keeps the last temperature it reported.
+        """
+        readings = self.readings()
+        return {device: readings[device][0] for device in readings}
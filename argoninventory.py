@@ -0,0 +1,266 @@
+#!/usr/bin/python3
+
+#
+# Static hardware inventory.
+#
+# The block devices, their sizes and types, RAID membership, the root device and the amount of
+# memory do not change while we run, unless a drive is plugged in or removed.  They are worked out
+# once and kept here, so the collectors that run every second only have to read the counters that
+# actually change.
+#
+# The block device topology (disk -> partition -> md/dm) comes from walking /sys/block, including
+# the holders/ and slaves/ links, so devices are classified by what sysfs says they are rather than
+# by their names.  When the daemon is running, kernel uevents keep it up to date as drives are
+# swapped in and out of the EON bays.
+#
+
+import os
+import threading
+from typing import NamedTuple, Tuple
+from argonprocfs import *
+from argonparse import *
+from argonnetlink import *
+
+#
+# Device types by the subsystem of the device behind the block device
+#
+SUBSYSTEM_KINDS = {"nvme": "nvme", "mmc": "mmcblk", "ide": "hd", "virtio": "virtio"}
+
+#
+# Kinds that are not storage in their own right
+#
+NONSTORAGE_KINDS = ("loop", "virtual", "rom")
+
+#
+class BlockDevice(NamedTuple):
+    name      : str    # Kernel name, i.e. sda1
+    disk      : str    # What the device is reported as, the whole disk for a partition, the dm name for dm
+    kind      : str    # sd, hd, mmcblk, nvme, md, dm, loop, virtual ...
+    sizekb    : int
+    mapper    : str    # The dm-N name of a device mapper device, otherwise None
+    partition : bool
+    holders   : Tuple[str, ...]    # md/dm devices built on top of this one
+    slaves    : Tuple[str, ...]    # devices an md/dm device is built from
+
+    @property
+    def storage( self ):
+        """ True for real storage, rather than loop, ram/zram or optical devices """
+        return self.kind not in NONSTORAGE_KINDS
+
+#
+class Inventory:
+    """
+    Everything about the hardware that only changes on hotplug.  An inventory is never changed once
+    published; hotplug builds an updated copy.
+    """
+    __slots__ = ('memtotal', 'devices', 'devnums', 'raidmembers', 'rootdev', 'signature')
+
+    def __init__( self ):
+        self.memtotal    = 0
+        self.devices     = {}     # kernel name -> BlockDevice
+        self.devnums     = {}     # "major:minor" -> BlockDevice
+        self.raidmembers = {}     # member device -> md array
+        self.rootdev     = ""
+        self.signature   = ()
+
+    def copy( self ):
+        other = Inventory()
+        other.memtotal    = self.memtotal
+        other.devices     = dict( self.devices )
+        other.devnums     = dict( self.devnums )
+        other.raidmembers = dict( self.raidmembers )
+        other.rootdev     = self.rootdev
+        other.signature   = self.signature
+        return other
+
+    def disks( self, kinds = None ):
+        """ Return the names of the whole disks, optionally only those of the given kinds """
+        return [d.name for d in self.devices.values()
+                if not d.partition and (kinds is None or d.kind in kinds)]
+
+#
+def argoninventory_readsysfs( path ):
+    try:
+        with open( path ) as sysfile:
+            return sysfile.read().strip()
+    except OSError:
+        return ""
+
+#
+def argoninventory_listdir( path ):
+    try:
+        return tuple( sorted( os.listdir( path ) ) )
+    except OSError:
+        return ()
+
+#
+def argoninventory_signature():
+    """ Cheap check for hotplug, the list of block devices """
+    return argoninventory_listdir( "/sys/block" )
+
+#
+def argoninventory_classify( path ):
+    """ Work out what kind of block device /sys/block/<name> is from sysfs """
+    if os.path.isdir( path + "/dm" ):
+        return "dm"
+    if os.path.isdir( path + "/md" ):
+        return "md"
+    if os.path.isdir( path + "/loop" ):
+        return "loop"
+    if not os.path.exists( path + "/device" ):
+        # ram, zram, unbound loop devices and the like
+        return "virtual"
+    subsystem = os.path.basename( os.path.realpath( path + "/device/subsystem" ) )
+    if subsystem == "scsi":
+        # SCSI type 0 is a disk (and 14 a simplified disk), anything else is optical, tape etc
+        if argoninventory_readsysfs( path + "/device/type" ) in ("0", "14"):
+            return "sd"
+        return "rom"
+    return SUBSYSTEM_KINDS.get( subsystem, "other" )
+
+#
+def argoninventory_adddevice( inventory, path, name, disk, kind, mapper, partition = False ):
+    try:
+        sizekb = int( argoninventory_readsysfs( path + "/size" ) ) >> 1
+    except ValueError:
+        sizekb = 0
+    device = BlockDevice( name, disk, kind, sizekb, mapper, partition,
+                          argoninventory_listdir( path + "/holders" ),
+                          argoninventory_listdir( path + "/slaves" ) )
+    inventory.devices[name] = device
+    devnum = argoninventory_readsysfs( path + "/dev" )
+    if devnum:
+        inventory.devnums[devnum] = device
+
+#
+def argoninventory_scandisk( inventory, name ):
+    """ Add a whole block device, and its partitions, to the inventory """
+    path = "/sys/block/" + name
+    if not os.path.isdir( path ):
+        return
+    kind = argoninventory_classify( path )
+    disk = name
+    mapper = None
+    if kind == "dm":
+        disk = argoninventory_readsysfs( path + "/dm/name" ) or name
+        mapper = name
+    argoninventory_adddevice( inventory, path, name, disk, kind, mapper )
+    for entry in argoninventory_listdir( path ):
+        if os.path.exists( path + "/" + entry + "/partition" ):
+            argoninventory_adddevice( inventory, path + "/" + entry, entry, name, kind, None, True )
+
+#
+def argoninventory_dropdisk( inventory, name ):
+    """ Remove a whole block device, and its partitions, from the inventory """
+    for device in [d for d in inventory.devices.values() if d.name == name or (d.partition and d.disk == name)]:
+        del inventory.devices[device.name]
+    for devnum in [n for n in inventory.devnums if inventory.devnums[n].name not in inventory.devices]:
+        del inventory.devnums[devnum]
+
+#
+def argoninventory_maplinks( inventory ):
+    """ Rebuild the RAID membership map from the md devices' slaves """
+    inventory.raidmembers = {}
+    for device in inventory.devices.values():
+        if device.kind == "md" and not device.partition:
+            for member in device.slaves:
+                inventory.raidmembers[member] = device.name
+    inventory.signature = argoninventory_signature()
+
+#
+def argoninventory_build():
+    """ Walk /sys/block and /proc to build a new inventory """
+    inventory = Inventory()
+
+    try:
+        meminfo = argonparse_keyvalues( argonprocfs_reader( "/proc/meminfo" ).lines(), [b"MemTotal:"] )
+        inventory.memtotal = int( meminfo.get( b"MemTotal:", 0 ) )
+    except (IOError, ValueError):
+        ...
+
+    for name in argoninventory_signature():
+        argoninventory_scandisk( inventory, name )
+    argoninventory_maplinks( inventory )
+
+    try:
+        for line in argonprocfs_reader( "/proc/self/mountinfo" ).lines():
+            fields = argonparse_fields( line )
+            if len(fields) > 4 and fields[4] == b"/":
+                device = inventory.devnums.get( fields[2].decode() )
+                if device is not None:
+                    inventory.rootdev = "/dev/" + device.name
+    except IOError:
+        ...
+    return inventory
+
+inventory = None
+inventorylock = threading.Lock()
+inventorylistener = None
+
+#
+def argoninventory_get():
+    """ Return the current inventory.  When uevents are being watched this is just a lookup,
+    otherwise the inventory is rebuilt if the set of block devices has changed.
+    """
+    global inventory
+    with inventorylock:
+        if inventory is None or (inventorylistener is None and inventory.signature != argoninventory_signature()):
+            inventory = argoninventory_build()
+        return inventory
+
+#
+def argoninventory_uevent( properties ):
+    """ Update the inventory for a block device uevent, only rescanning the devices involved """
+    global inventory
+    with inventorylock:
+        if inventory is None or properties is None:
+            # Nothing to update yet, or we lost events
+            inventory = argoninventory_build()
+            return
+        devpath = properties.get( "DEVPATH", "" )
+        name = os.path.basename( devpath )
+        if properties.get( "DEVTYPE" ) == "partition":
+            # Rescan the disk the partition is on
+            name = os.path.basename( os.path.dirname( devpath ) )
+
+        updated = inventory.copy()
+        argoninventory_dropdisk( updated, name )
+        if not (properties.get( "ACTION" ) == "remove" and properties.get( "DEVTYPE" ) != "partition"):
+            argoninventory_scandisk( updated, name )
+
+        #
+        # Whatever this disk is built from, or whatever is built on it, has had its holders or
+        # slaves changed as well, so rescan those too.
+        #
+        names = set()
+        for devices in (inventory.devices, updated.devices):
+            names.update( [d.name for d in devices.values() if d.name == name or (d.partition and d.disk == name)] )
+        related = set()
+        for devices in (inventory.devices, updated.devices):
+            for device in devices.values():
+                if device.name in names:
+                    related.update( device.slaves )
+                    related.update( device.holders )
+                elif names.intersection( device.holders ) or names.intersection( device.slaves ):
+                    related.add( device.name )
+        for relatedname in related:
+            device = inventory.devices.get( relatedname ) or updated.devices.get( relatedname )
+            if device is not None and device.partition:
+                relatedname = device.disk
+            if relatedname != name:
+                argoninventory_dropdisk( updated, relatedname )
+                argoninventory_scandisk( updated, relatedname )
+        argoninventory_maplinks( updated )
+        inventory = updated
+
+#
+def argoninventory_startwatch():
+    """ Keep the inventory current from kernel uevents, for long running processes """
+    global inventorylistener
+    if inventorylistener is None:
+        try:
+            inventorylistener = UeventListener( argoninventory_uevent )
+            inventorylistener.start()
+        except OSError:
+            inventorylistener = None
+    return inventorylistener
@@ -0,0 +1,101 @@
+#!/usr/bin/python3
+
+#
+# System load, as an early warning for the fan.
+#
+# Temperatures lag the work that causes them, a drive can take minutes to warm up once a scrub or
+# rebuild starts.  The kernel's pressure stall information (/proc/pressure) tells us how much time
+# tasks spend waiting for the CPU or for I/O, and the disk busy time tells us how hard the drives
+# are working, so the fan can be brought up as the load starts rather than once the heat arrives.
+#
+
+import math
+import time
+import threading
+from argonprocfs import *
+from argonparse import *
+from argonlogging import *
+
+#
+def argonload_readpressure( resource ):
+    """
+    Read /proc/pressure/<resource> (cpu, io or memory).  Returns a dictionary of "some" and "full"
+    to a dictionary of avg10, avg60 and avg300 (percent of time stalled), or None if the kernel
+    does not have PSI.
+    """
+    output = {}
+    try:
+        for line in argonprocfs_reader( "/proc/pressure/" + resource ).lines():
+            fields = argonparse_fields( line )
+            if len(fields) < 4:
+                continue
+            averages = {}
+            for field in fields[1:4]:
+                name, sep, value = field.partition( b"=" )
+                averages[name.decode()] = float( value )
+            output[fields[0].decode()] = averages
+    except (OSError, ValueError):
+        return None
+    return output
+
+#
+class LoadMonitor( threading.Thread ):
+    """
+    Work out how loaded the system is, every interval seconds, as a percentage:
+
+        cpu  - share of time some task was waiting for a CPU, over the last minute
+        io   - share of time some task was waiting for I/O, over the last minute
+        disk - the busy time of the busiest drive, averaged with a time constant of tau seconds
+
+    load is the largest of the three.  Both PSI figures are averaged over a minute by the kernel,
+    and the disk figure over about the same by us, so only sustained load counts, and the load
+    falls away again once the work stops.  diskbusy is a callable returning a dictionary of
+    device name to percent busy, and onsample is called with status() after every sample.
+    """
+    def __init__( self, diskbusy = None, interval = 5, tau = 60, onsample = None ):
+        super().__init__( name = "load", daemon = True )
+        self.diskbusy = diskbusy
+        self.onsample = onsample
+        self.interval = interval
+        self.tau      = tau
+        self.cpu      = 0.0
+        self.io       = 0.0
+        self.disk     = None
+        self.stamp    = None
+
+    def sample( self ):
+        cpu = argonload_readpressure( "cpu" )
+        io  = argonload_readpressure( "io" )
+        self.cpu = cpu['some']['avg60'] if cpu else 0.0
+        self.io  = io['some']['avg60'] if io else 0.0
+
+        busy = 0.0
+        if self.diskbusy is not None:
+            busy = max( self.diskbusy().values(), default = 0.0 )
+        now = time.monotonic()
+        if self.disk is None or self.stamp is None:
+            self.disk = busy
+        else:
+            alpha = 1 - math.exp( -(now - self.stamp)/self.tau )
+            self.disk += alpha*(busy - self.disk)
+        self.stamp = now
+
+    @property
+    def load( self ):
+        return max( self.cpu, self.io, self.disk or 0.0 )
+
+    def status( self ):
+        return {'cpu': self.cpu, 'io': self.io, 'disk': self.disk or 0.0, 'load': self.load}
+
+    def run( self ):
+        while True:
+            try:
+                self.sample()
+            except Exception:
+                ...
+            if self.onsample is not None:
+                try:
+                    self.onsample( self.status() )
+                except Exception as e:
+                    logError( "Error handling a load sample: " + str(e) )
+            time.sleep( self.interval )
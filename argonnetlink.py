@@ -0,0 +1,226 @@
+#!/usr/bin/python3
+
+#
+# Netlink listeners.
+#
+# The kernel announces hotplug events on a NETLINK_KOBJECT_UEVENT socket, and address changes on
+# the rtnetlink multicast groups, so rather than polling for changes we block on the sockets and
+# get told as soon as something happens.
+#
+
+import time
+import errno
+import socket
+import struct
+import threading
+from argonlogging import *
+
+NETLINK_ROUTE = 0
+NETLINK_KOBJECT_UEVENT = 15
+UEVENT_KERNEL_GROUP = 1
+
+#
+# The longest we wait (in seconds) before trying a socket that keeps failing again
+#
+NETLINK_MAXBACKOFF = 300
+
+#
+# rtnetlink, from <linux/netlink.h>, <linux/rtnetlink.h> and <linux/if_addr.h>
+#
+NLMSG_ERROR = 2
+NLMSG_DONE  = 3
+NLM_F_REQUEST = 0x001
+NLM_F_DUMP    = 0x300
+RTM_NEWADDR = 20
+RTM_DELADDR = 21
+RTM_GETADDR = 22
+RTMGRP_IPV4_IFADDR = 0x010
+RTMGRP_IPV6_IFADDR = 0x100
+IFA_ADDRESS = 1
+IFA_LOCAL   = 2
+IFA_LABEL   = 3
+
+NLMSGHDR = struct.Struct( "=IHHII" )     # length, type, flags, sequence, port id
+IFADDRMSG = struct.Struct( "=BBBBI" )    # family, prefix length, flags, scope, interface index
+RTATTR = struct.Struct( "=HH" )          # length, type
+
+#
+def argonnetlink_parseuevent( message ):
+    """ A kernel uevent is "action@devpath" followed by NUL separated KEY=value pairs.  Returns the
+    dictionary of the pairs, or None if this is not a kernel uevent (udev sends its own format).
+    """
+    parts = message.split( b"\0" )
+    if b"@" not in parts[0]:
+        return None
+    properties = {}
+    for part in parts[1:]:
+        key, sep, value = part.partition( b"=" )
+        if sep:
+            properties[key.decode()] = value.decode( errors = "replace" )
+    return properties
+
+#
+class UeventListener( threading.Thread ):
+    """
+    Listen for kernel uevents, calling onevent with the properties (ACTION, DEVPATH, SUBSYSTEM,
+    DEVNAME, DEVTYPE ...) of each event for the subsystems we were asked about.  If the socket
+    overflowed and events were lost, onevent is called with None so everything can be rescanned.
+    """
+    def __init__( self, onevent, subsystems = ("block",) ):
+        super().__init__( name = "uevent", daemon = True )
+        self.onevent    = onevent
+        self.subsystems = subsystems
+        self.sock       = socket.socket( socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_KOBJECT_UEVENT )
+        self.sock.setsockopt( socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20 )
+        self.sock.bind( (0, UEVENT_KERNEL_GROUP) )
+
+    def run( self ):
+        backoff = 1
+        while True:
+            try:
+                message = self.sock.recv( 65536 )
+            except OSError as e:
+                if e.errno == errno.ENOBUFS:
+                    self.onevent( None )
+                else:
+                    logError( "Error reading kernel uevents, retrying in " + str(backoff) + "s: " + str(e) )
+                    time.sleep( backoff )
+                    backoff = min( backoff*2, NETLINK_MAXBACKOFF )
+                continue
+            backoff = 1
+            properties = argonnetlink_parseuevent( message )
+            if properties is None or properties.get( "SUBSYSTEM" ) not in self.subsystems:
+                continue
+            try:
+                self.onevent( properties )
+            except Exception:
+                ...
+
+#
+def argonnetlink_align( length ):
+    return (length + 3) & ~3
+
+#
+def argonnetlink_messages( data ):
+    """ Split a netlink datagram into (type, payload) for each message in it """
+    offset = 0
+    while offset + NLMSGHDR.size <= len(data):
+        length, msgtype, flags, seq, pid = NLMSGHDR.unpack_from( data, offset )
+        if length < NLMSGHDR.size:
+            break
+        yield (msgtype, data[offset + NLMSGHDR.size:offset + length])
+        offset += argonnetlink_align( length )
+
+#
+def argonnetlink_parseaddr( payload ):
+    """ Decode the ifaddrmsg of an RTM_NEWADDR/RTM_DELADDR message into
+    (interface index, interface name, family, address).  The name comes from IFA_LABEL when the
+    kernel gives one (IPv4 only), otherwise it is looked up from the index.
+    """
+    family, prefixlen, flags, scope, index = IFADDRMSG.unpack_from( payload )
+    attrs = {}
+    offset = IFADDRMSG.size
+    while offset + RTATTR.size <= len(payload):
+        length, attrtype = RTATTR.unpack_from( payload, offset )
+        if length < RTATTR.size:
+            break
+        attrs[attrtype] = payload[offset + RTATTR.size:offset + length]
+        offset += argonnetlink_align( length )
+
+    # IFA_LOCAL is our end of a point to point link, IFA_ADDRESS the far end, otherwise they match
+    address = attrs.get( IFA_LOCAL, attrs.get( IFA_ADDRESS ) )
+    if address is None:
+        return None
+    if IFA_LABEL in attrs:
+        name = attrs[IFA_LABEL].split( b"\0" )[0].decode()
+    else:
+        try:
+            name = socket.if_indextoname( index )
+        except OSError:
+            name = str(index)
+    return (index, name, family, socket.inet_ntop( family, address ))
+
+#
+def argonnetlink_dumpaddresses():
+    """ Ask the kernel for every address on every interface.  Returns a dictionary of
+    (interface index, family, address) to interface name.
+    """
+    table = {}
+    with socket.socket( socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE ) as sock:
+        sock.bind( (0, 0) )
+        request = NLMSGHDR.pack( NLMSGHDR.size + IFADDRMSG.size, RTM_GETADDR, NLM_F_REQUEST | NLM_F_DUMP, 1, 0 )
+        sock.send( request + IFADDRMSG.pack( socket.AF_UNSPEC, 0, 0, 0, 0 ) )
+        while True:
+            for msgtype, payload in argonnetlink_messages( sock.recv( 65536 ) ):
+                if msgtype == NLMSG_DONE:
+                    return table
+                if msgtype == NLMSG_ERROR:
+                    raise OSError( "RTM_GETADDR dump failed" )
+                if msgtype == RTM_NEWADDR:
+                    entry = argonnetlink_parseaddr( payload )
+                    if entry is not None:
+                        table[(entry[0], entry[2], entry[3])] = entry[1]
+
+#
+class AddressTable( threading.Thread ):
+    """
+    The addresses of every interface, dumped from the kernel once and then kept up to date from
+    the rtnetlink address notifications.  addresses is a tuple of (interface, family, address) in
+    interface order that is replaced, never changed, so it can be read without locking.  onchange
+    is called with no arguments whenever an address comes or goes.
+    """
+    def __init__( self, onchange = None ):
+        super().__init__( name = "rtnetlink", daemon = True )
+        self.onchange  = onchange
+        self.addresses = ()
+        self.sock      = socket.socket( socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE )
+        self.sock.setsockopt( socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20 )
+        # Subscribe before dumping, so nothing that changes during the dump is missed
+        self.sock.bind( (0, RTMGRP_IPV4_IFADDR | RTMGRP_IPV6_IFADDR) )
+        self.reload()
+
+    def reload( self ):
+        self.table = argonnetlink_dumpaddresses()
+        self.publish()
+
+    def publish( self ):
+        self.addresses = tuple( (self.table[key], key[1], key[2]) for key in sorted( self.table ) )
+
+    def run( self ):
+        backoff = 1
+        while True:
+            try:
+                data = self.sock.recv( 65536 )
+            except OSError as e:
+                if e.errno == errno.ENOBUFS:
+                    # Notifications were lost, start again from a fresh dump
+                    try:
+                        self.reload()
+                    except OSError:
+                        ...
+                else:
+                    logError( "Error reading address notifications, retrying in " + str(backoff) + "s: " + str(e) )
+                    time.sleep( backoff )
+                    backoff = min( backoff*2, NETLINK_MAXBACKOFF )
+                continue
+            backoff = 1
+            changed = False
+            for msgtype, payload in argonnetlink_messages( data ):
+                if msgtype != RTM_NEWADDR and msgtype != RTM_DELADDR:
+                    continue
+                entry = argonnetlink_parseaddr( payload )
+                if entry is None:
+                    continue
+                key = (entry[0], entry[2], entry[3])
+                if msgtype == RTM_NEWADDR:
+                    self.table[key] = entry[1]
+                else:
+                    self.table.pop( key, None )
+                changed = True
+            if changed:
+                self.publish()
+                if self.onchange is not None:
+                    try:
+                        self.onchange()
+                    except Exception:
+                        ...
@@ -0,0 +1,148 @@
+#!/usr/bin/python3
+
+#
+# NVMe drive temperature and health.
+#
+# The nvme driver registers a hwmon node for each controller, whose temp1_input is the composite
+# temperature the drive reports, so the temperature is just a sysfs read.  For kernels built
+# without NVMe hwmon support, and for the rest of the health information, we ask the controller
+# for its SMART / Health Information log page directly with the admin command ioctl, rather than
+# running smartctl or nvme-cli.
+#
+
+import os
+import fcntl
+import ctypes
+import struct
+from typing import NamedTuple, Tuple
+from argonprocfs import *
+
+#
+# struct nvme_admin_cmd from <linux/nvme_ioctl.h>, and NVME_IOCTL_ADMIN_CMD = _IOWR('N', 0x41, ...)
+#
+NVME_ADMIN_CMD = struct.Struct( "<BBHIIIQQII6III" )
+NVME_IOCTL_ADMIN_CMD = (3 << 30) | (NVME_ADMIN_CMD.size << 16) | (ord('N') << 8) | 0x41
+
+NVME_ADMIN_GET_LOG_PAGE = 0x02
+NVME_LOG_SMART          = 0x02
+NVME_LOG_SMART_SIZE     = 512
+NVME_NSID_ALL           = 0xFFFFFFFF
+
+#
+class NVMeHealth(NamedTuple):
+    criticalwarning : int
+    celsius         : float
+    availablespare  : int      # percent
+    sparethreshold  : int      # percent
+    percentused     : int      # of the rated endurance, can go over 100
+    poweronhours    : int
+    unsafeshutdowns : int
+    mediaerrors     : int
+    sensors         : Tuple[float, ...]
+
+#
+def argonnvme_listcontrollers():
+    """
+    Return the names of the NVMe controllers in the system (nvme0, nvme1 ...)
+    """
+    try:
+        return sorted( [d for d in os.listdir( "/sys/class/nvme" ) if d.startswith( "nvme" )] )
+    except OSError:
+        return []
+
+#
+def argonnvme_maphwmon():
+    """
+    Map each NVMe controller to the temp1_input of its hwmon node, which holds the composite
+    temperature.  Controllers without a hwmon node map to None.
+    """
+    output = {}
+    for controller in argonnvme_listcontrollers():
+        path = "/sys/class/nvme/" + controller
+        output[controller] = None
+        try:
+            for entry in sorted( os.listdir( path ) ):
+                if entry.startswith( "hwmon" ) and os.path.exists( path + "/" + entry + "/temp1_input" ):
+                    output[controller] = path + "/" + entry + "/temp1_input"
+                    break
+        except OSError:
+            ...
+    return output
+
+#
+def argonnvme_readtemp( path ):
+    """
+    Read a hwmon temperature, returning None if it cannot be read.
+    """
+    try:
+        return argonprocfs_reader( path ).readint() / 1000
+    except (OSError, ValueError):
+        return None
+
+#
+def argonnvme_kelvin( value ):
+    """ The log page reports temperatures in Kelvin, 0 for a sensor that is not implemented """
+    if value == 0:
+        return None
+    return value - 273
+
+#
+def argonnvme_parsesmartlog( page ):
+    """
+    Decode the SMART / Health Information log page (log identifier 2) of the NVMe specification.
+    """
+    sensors = struct.unpack_from( "<8H", page, 200 )
+    return NVMeHealth( page[0],
+                       argonnvme_kelvin( struct.unpack_from( "<H", page, 1 )[0] ),
+                       page[3],
+                       page[4],
+                       page[5],
+                       int.from_bytes( page[128:144], "little" ),
+                       int.from_bytes( page[144:160], "little" ),
+                       int.from_bytes( page[160:176], "little" ),
+                       tuple( argonnvme_kelvin( s ) for s in sensors if s != 0 ) )
+
+#
+def argonnvme_smartlog( controller ):
+    """
+    Fetch the SMART / Health Information log of a controller with a single Get Log Page admin
+    command.  This needs root, returns None if the controller cannot be asked.
+    """
+    page = ctypes.create_string_buffer( NVME_LOG_SMART_SIZE )
+    numd = NVME_LOG_SMART_SIZE // 4 - 1
+    cmd = bytearray( NVME_ADMIN_CMD.pack( NVME_ADMIN_GET_LOG_PAGE, 0, 0, NVME_NSID_ALL, 0, 0, 0,
+                                          ctypes.addressof( page ), 0, NVME_LOG_SMART_SIZE,
+                                          (numd << 16) | NVME_LOG_SMART, 0, 0, 0, 0, 0, 0, 0 ) )
+    try:
+        fd = os.open( "/dev/" + controller, os.O_RDONLY )
+    except OSError:
+        return None
+    try:
+        if fcntl.ioctl( fd, NVME_IOCTL_ADMIN_CMD, cmd ) != 0:
+            return None
+    except OSError:
+        return None
+    finally:
+        os.close( fd )
+    return argonnvme_parsesmartlog( page.raw )
+
+#
+def argonnvme_temperatures( hwmon = None ):
+    """
+    Return a dictionary of controller name to composite temperature (in C) for every NVMe drive
+    that reported one.  hwmon is the result of argonnvme_maphwmon(), worked out here if not given.
+    """
+    if hwmon is None:
+        hwmon = argonnvme_maphwmon()
+    output = {}
+    for controller in hwmon:
+        theTemp = None
+        if hwmon[controller] is not None:
+            theTemp = argonnvme_readtemp( hwmon[controller] )
+        if theTemp is None:
+            health = argonnvme_smartlog( controller )
+            if health is not None:
+                theTemp = health.celsius
+        if theTemp:
+            output[controller] = theTemp
+    return output
@@ -29,13 +29,14 @@ import sys
 import os
 import time
 
-from threading import Thread
+from threading import Thread, Event
 from queue import Queue
 
 sys.path.append("/etc/argon/")
 from argonsysinfo import *
 from argonlogging import *
 from argonconfig import *
+from argonsnapshot import *
 from version import *
 
 # Initialize I2C Bus
@@ -50,6 +51,24 @@ else:
 CONFIG_FILE='/etc/argoneon.conf'
 OLED_ENABLED=False
 
+#
+# Shared snapshot of the system state, used by the fan and OLED threads
+#
+snapshotcollector = SnapshotCollector()
+
+#
+# Set to have the fan thread look at the fan speed right away, rather than at its next interval
+#
+fanwakeup = Event()
+
+#
+# Hysteresis for the fan speed, the loops for pid mode, and how long to wait between checks,
+# used by the fan thread
+#
+fancontroller = FanController()
+fanpid = FanPID()
+fanschedule = FanSchedule()
+
 #
 # Enable logging
 #
@@ -92,27 +111,9 @@ def shutdown_check(writeq):
         elif pulsetime >=6 and pulsetime <=7:
             writeq.put("OLEDSWITCH")
 
-#
-#
-#
-def get_fanspeed(tempval, configlist):
-    """
-    This function converts the corresponding fanspeed for the given temperature the
-    configutation data is a list of strings in the form "<temperature>:<speed>"
-    """
-    retval = 0
-    if len(configlist) > 0:
-        for k in configlist.keys():
-            if tempval >= float(k):
-                retval=int(configlist[k])
-                logDebug( "Temperature (" + str(tempval) + ") >= " + str(k) + " suggesting fanspeed of " + str(retval) )
-    logDebug( "Returning fanspeed of " + str(retval))
-    return retval
-
-
 # This function is the thread that monitors temperature and sets the fan speed
-# The value is fed to get_fanspeed to get the new fan speed
-# To prevent unnecessary fluctuations, lowering fan speed is delayed by 30 seconds
+# The values are looked up in the compiled fan curves (see argonfan) to get the new fan speed
+# To prevent unnecessary fluctuations, changes go through the hysteresis of the fan controller
 #
 # Location of config file varies based on OS
 #
@@ -126,8 +127,10 @@ def setFanFlatOut ():
 def setFanSpeed (overrideSpeed : int = None, instantaneous : bool = True):
     """
     Set the fanspeed.  Support override (overrideSpeed) with a specific value, and 
-    an instantaneous change.  Some hardware does not like the sudden change, it wants the
-    speed set to 100% THEN changed to the new value.  Not really sure why this is.
+    an instantaneous change.  Otherwise the change goes through the fan controller's hysteresis,
+    which may leave the speed where it is for now.  Some hardware does not like the sudden change,
+    it wants the speed set to 100% THEN changed to the new value when starting from a standstill.
+    Not really sure why this is.
     """
     prevspeed    = argonsysinfo_getCurrentFanSpeed()
     if not prevspeed:
@@ -137,20 +140,41 @@ def setFanSpeed (overrideSpeed : int = None, instantaneous : bool = True):
     if overrideSpeed is not None:
         newspeed = overrideSpeed
     else:
-        newspeed = max([get_fanspeed(argonsysinfo_getcputemp(), loadCPUFanConfig())
-                       ,get_fanspeed(argonsysinfo_getmaxhddtemp(), loadHDDFanConfig())
-                       ]
-                      )
-        if newspeed < prevspeed and not instantaneous:
-            # Pause 30s before speed reduction to prevent fluctuations
-            time.sleep(30)
+        temperatures = snapshotcollector.get('temperatures')
+        load = argonsysinfo_getload()
+        cpuspeed, hddspeed, loadspeed = currentconfig.fancurves().speeds( temperatures.cpu, temperatures.hddmax, load['load'] )
+        logDebug( "CPU " + str(temperatures.cpu) + "C suggesting fanspeed of " + str(cpuspeed) +
+                  ", HDD " + str(temperatures.hddmax) + "C suggesting " + str(hddspeed) +
+                  ", load (cpu " + str(load['cpu']) + "% io " + str(load['io']) + "% disk " + str(int(load['disk'])) +
+                  "%) suggesting " + str(loadspeed) )
+        if currentconfig.fanmode() == 'pid':
+            newspeed = fanpid.update( currentconfig.fanpid(), time.monotonic(), temperatures.cpu, temperatures.hddmax )
+            logDebug( "PID suggesting fanspeed of " + str(newspeed) + " (cpu integral " + str(round(fanpid.cpu.integral,1)) +
+                      ", hdd integral " + str(round(fanpid.hdd.integral,1)) + ")" )
+            newspeed = max( newspeed, loadspeed )
+        else:
+            # So switching back to pid does not integrate the time spent on the curves
+            fanpid.restart()
+            if instantaneous:
+                newspeed = max( cpuspeed, hddspeed, loadspeed )
+            else:
+                newspeed = fancontroller.update( currentconfig.fancurves(), currentconfig.fancontrol(), prevspeed, time.monotonic(),
+                                                 temperatures.cpu, temperatures.hddmax, load['load'] )
+                if fancontroller.falling is not None:
+                    logDebug( "Slowing the fan down from " + str(prevspeed) + " is pending" )
+        throttle = argonsysinfo_getthrottle()
+        if throttle['state'] != "ok":
+            # Throttling, or about to, so do not wait for the curve to catch up
+            throttlespeed = currentconfig.getint('FanControl', 'throttlespeed')
+            logDebug( "CPU " + throttle['state'] + " at " + str(throttle['freq']) + "MHz, suggesting fanspeed of " + str(throttlespeed) )
+            newspeed = max( newspeed, throttlespeed )
 
     # Make sure the value is in 0-100 range
     newspeed = max([min([100,newspeed]),0])
     if overrideSpeed is not None or (prevspeed != newspeed):
         try:
-            if newspeed > 0:
-                # Spin up to prevent issues on older units
+            if newspeed > 0 and prevspeed == 0:
+                # Spin up from a standstill to prevent issues on older units
                 bus.write_byte(ADDR_FAN,100)
                 time.sleep(1)
             bus.write_byte(ADDR_FAN,int(newspeed))
@@ -161,15 +185,74 @@ def setFanSpeed (overrideSpeed : int = None, instantaneous : bool = True):
             return prevspeed
     return newspeed
 
+def raid_check(writeq):
+    """
+    Thread that waits for the state of any RAID array to change.  The new state is published for
+    other applications, and if the OLED is in use it is switched over to the RAID screen.
+    """
+    def raid_changed(raidlist):
+        argonsysinfo_publish( raidstate, raidlist )
+        snapshotcollector.update( 'raid', argonsnapshot_raid( raidlist ) )
+        for item in raidlist['raidlist']:
+            logInfo( "RAID array " + item['title'] + " state changed to " + item['info']['state'] )
+        if OLED_ENABLED == True:
+            writeq.put("OLEDRAID")
+
+    watcher = RaidWatcher( raid_changed )
+    watcher.run()
+
+def throttle_changed(state):
+    """
+    Called by the throttle monitor when the CPU starts or stops being throttled.
+    """
+    if state == "throttled":
+        logWarning( "CPU is being throttled, running at " + str(argonsysinfo_getthrottle()['freq']) + "MHz" )
+    else:
+        logInfo( "CPU throttling state is now " + state )
+    fanwakeup.set()
+
+def temp_sampled(status):
+    """
+    Called by the throttle monitor with every sample, which includes the CPU temperature.  If the CPU
+    has warmed up noticeably since the fan thread last looked, it is woken rather than left waiting.
+    Nothing else is done here, collecting the temperatures can wait on smartctl and this runs on the
+    throttle monitor's thread.
+    """
+    if fanschedule.wake( status['temp'] ):
+        fanwakeup.set()
+
+def load_sampled(status):
+    """
+    Called by the load monitor with every sample.  If the load has gone up far enough to raise the
+    LoadFan speed since the fan thread last looked, it is woken rather than left waiting.
+    """
+    if fanschedule.wakeload( currentconfig.fancurves(), status['load'] ):
+        fanwakeup.set()
+
 def temp_check():
     """
-    Main thread for processing the temperature check functonality.  We just try and set the fan speed once
-    a minute.  However we do want to start with the fan *OFF*.
+    Main thread for processing the temperature check functonality.  We set the fan speed, then wait
+    for as long as the fan schedule says we can: every few seconds while a temperature is near a
+    threshold, rising, or a change of speed is pending, backing off to a few minutes while things are
+    stable.  The wait is cut short when the throttling state changes, the CPU suddenly warms up, or
+    the load rises enough to raise the LoadFan speed.
+    However we do want to start with the fan *OFF*.
     """
     setFanOff()
     while True:
-        setFanSpeed (instantaneous = False)
-        time.sleep(60)
+        # Start from current temperatures, the snapshot may be a few seconds behind a wake up
+        snapshotcollector.collect( 'temperatures' )
+        speed = setFanSpeed (instantaneous = False)
+        mode = currentconfig.fanmode()
+        mininterval, maxinterval = currentconfig.fanintervals()
+        temperatures = snapshotcollector.get('temperatures')
+        interval = fanschedule.next( currentconfig.fancurves(), mininterval, maxinterval, time.monotonic(),
+                                     temperatures.cpu, temperatures.hddmax, argonsysinfo_getload()['load'],
+                                     pending = fancontroller.pending or mode == 'pid' )
+        logDebug( "Next fan check in " + str(round(interval,1)) + " seconds (" + fanschedule.reason + ")" )
+        argonsysinfo_publish( fancontrolstate, dict( fanschedule.status(), mode = mode, speed = speed ) )
+        fanwakeup.wait(interval)
+        fanwakeup.clear()
 #
 # This function is the thread that updates OLED
 #
@@ -182,44 +265,38 @@ def display_loop(readq):
     fontwdReg = 8    # Maps to 8x16
     stdleftoffset = 54
 
-    temperature="C"
-    temperature = loadTempConfig()
-
-    print( "Temperature config is " + temperature )
     screensavermode = False
-    screensaversec = 120
     screensaverctr = 0
 
-    screenenabled = ["clock", "ip"]
     prevscreen = ""
     curscreen = ""
     screenid = 0
-    screenjogtime = 0
     screenjogflag = 0  # start with screenid 0
-    cpuusagelist = []
     curlist = []
 
-    tmpconfig=loadOLEDConfig()  
-
-    if "screensaver" in tmpconfig:
-        screensaversec = int(tmpconfig["screensaver"])
-    if "screenduration" in tmpconfig:
-        screenjogtime = int(tmpconfig["screenduration"])
-    if "screenlist" in tmpconfig:
-        screenenabled = tmpconfig["screenlist"].replace("\"","").split(" ")
-
-    if "enabled" in tmpconfig:
-        if tmpconfig["enabled"] == "N":
-            screenenabled = []
-
     #
-    # Setup some variables to help calculate bandwidth
+    # The OLED settings are picked up again whenever the configuration file changes
     #
-    timespan = 1
-    prevData = argonsysinfo_diskusage()
-    prevTime = time.clock_gettime_ns(time.CLOCK_MONOTONIC)
+    configgeneration = -1
+    screenenabled = ["clock"]
 
     while len(screenenabled) > 0:
+        currentconfig.get()
+        if configgeneration != currentconfig.generation:
+            configgeneration = currentconfig.generation
+            temperature     = loadTempConfig()
+            screensaversec  = currentconfig.getint('OLED', 'screensaver')
+            screenjogtime   = currentconfig.getint('OLED', 'screenduration')
+            screenenabled   = currentconfig.getlist('OLED', 'screenlist')
+            if not currentconfig.getbool('OLED', 'enabled'):
+                screenenabled = []
+            logInfo( "OLED screens " + " ".join(screenenabled) + ", temperature in " + temperature )
+            if len(screenenabled) == 0:
+                break
+            if screenid >= len(screenenabled):
+                screenid = 0
+            curlist = []
+
         if len(curlist) == 0 and screenjogflag == 1:
             # Reset Screen Saver
             screensavermode = False
@@ -243,9 +320,7 @@ def display_loop(readq):
             # CPU Usage
             if len(curlist) == 0:
                 try:
-                    if len(cpuusagelist) == 0:
-                        cpuusagelist = argonsysinfo_listcpuusage()
-                    curlist = cpuusagelist
+                    curlist = list(snapshotcollector.get('cpu'))
                 except:
                     logError( "Error processing information for CPU display")
                     curlist = []
@@ -258,9 +333,9 @@ def display_loop(readq):
                 while tmpmax > 0 and len(curlist) > 0:
                     curline = ""
                     tmpitem = curlist.pop(0)
-                    curline = tmpitem["title"]+": "+str(tmpitem["value"])+"%"
+                    curline = tmpitem.name+": "+str(tmpitem.percent)+"%"
                     oled_writetext(curline, stdleftoffset, yoffset, fontwdSml)
-                    oled_drawfilledrectangle(stdleftoffset, yoffset+12, int((oledscreenwidth-stdleftoffset-4)*tmpitem["value"]/100), 2)
+                    oled_drawfilledrectangle(stdleftoffset, yoffset+12, int((oledscreenwidth-stdleftoffset-4)*tmpitem.percent/100), 2)
                     tmpmax = tmpmax - 1
                     yoffset = yoffset + 16
 
@@ -272,10 +347,7 @@ def display_loop(readq):
             # Storage Info
             if len(curlist) == 0:
                 try:
-                    tmpobj = argonsysinfo_listhddusage()
-                    for curdev in tmpobj:
-                        curlist.append({"title": curdev, "value": argonsysinfo_kbstr(tmpobj[curdev]['total']), "usage": int(tmpobj[curdev]['percent']) })
-                    #curlist = argonsysinfo_liststoragetotal()
+                    curlist = list(snapshotcollector.get('disks'))
                 except:
                     logError( "Error processing information for STORAGE display")
                     curlist = []
@@ -287,9 +359,9 @@ def display_loop(readq):
                 while tmpmax > 0 and len(curlist) > 0:
                     tmpitem = curlist.pop(0)
                     # Right column first, safer to overwrite white space
-                    oled_writetextaligned(tmpitem["value"], 77, yoffset, oledscreenwidth-77, 2, fontwdSml)
-                    oled_writetextaligned(str(tmpitem["usage"])+"%", 50, yoffset, 74-50, 2, fontwdSml)
-                    tmpname = tmpitem["title"]
+                    oled_writetextaligned(argonsysinfo_kbstr(tmpitem.totalkb), 77, yoffset, oledscreenwidth-77, 2, fontwdSml)
+                    oled_writetextaligned(str(int(tmpitem.percent))+"%", 50, yoffset, 74-50, 2, fontwdSml)
+                    tmpname = tmpitem.name
                     if len(tmpname) > 8:
                         tmpname = tmpname[0:8]
                     oled_writetext(tmpname, 0, yoffset, fontwdSml)
@@ -305,17 +377,7 @@ def display_loop(readq):
             # Bandwidth info
             if len(curlist) == 0:
                 try:
-                    diskdata = argonsysinfo_diskusage()
-                    for istop in diskdata:
-                        for istart in prevData:
-                            if istop['disk'] == istart['disk']:
-                                istart['readsector']  = istop['readsector'] - istart['readsector']
-                                istart['writesector'] = istop['writesector'] - istart['writesector']
-                    curlist   = prevData
-                    prevData  = diskdata
-                    stoptime  = time.clock_gettime_ns(time.CLOCK_MONOTONIC)
-                    timespan = (stoptime - prevTime)/1000000000
-                    prevTime  = stoptime
+                    curlist = list(snapshotcollector.get('bandwidth'))
                 except:
                     logError( "Error processing data for BANDWIDTH display")
                     curlist = []
@@ -331,11 +393,9 @@ def display_loop(readq):
                 yoffset   = 32
                 while itemcount > 0 and len(curlist) >0:
                     item = curlist.pop(0)
-                    bandwidth = int((item['writesector']/2)/timespan)
-                    oled_writetextaligned( argonsysinfo_kbstr(bandwidth), 77, yoffset, oledscreenwidth-77, 2, fontwdSml )
-                    bandwidth = int((item['readsector']/2)/timespan)
-                    oled_writetextaligned( argonsysinfo_kbstr(bandwidth), 50, yoffset, 74-50, 2, fontwdSml )
-                    oled_writetext( item['disk'], 0, yoffset, fontwdSml )
+                    oled_writetextaligned( argonsysinfo_kbstr(int(item.writekb)), 77, yoffset, oledscreenwidth-77, 2, fontwdSml )
+                    oled_writetextaligned( argonsysinfo_kbstr(int(item.readkb)), 50, yoffset, 74-50, 2, fontwdSml )
+                    oled_writetext( item.name, 0, yoffset, fontwdSml )
                     itemcount = itemcount - 1
                     yoffset   = yoffset + 16
 
@@ -344,30 +404,82 @@ def display_loop(readq):
                 # Next Page due to error/no data
                 screenjogFlag = 1
 
+        elif curscreen == "network":
+            # Network throughput
+            if len(curlist) == 0:
+                try:
+                    curlist = list(snapshotcollector.get('throughput'))
+                except:
+                    logError( "Error processing data for NETWORK display")
+                    curlist = []
+            if len(curlist) > 0:
+
+                oled_clearbuffer()
+                oled_writetextaligned( "NETWORK", 0, 0, oledscreenwidth, 1, fontwdSml)
+                oled_writetextaligned( "Tx", 77, 16, oledscreenwidth-77, 2, fontwdSml)
+                oled_writetextaligned( "Rx", 50, 16, 74-50,              2, fontwdSml)
+                oled_writetext( "Device", 0, 16, fontwdSml )
+
+                itemcount = 2
+                yoffset   = 32
+                while itemcount > 0 and len(curlist) >0:
+                    item = curlist.pop(0)
+                    oled_writetextaligned( argonsysinfo_kbstr(int(item.txbytes/1024)), 77, yoffset, oledscreenwidth-77, 2, fontwdSml )
+                    oled_writetextaligned( argonsysinfo_kbstr(int(item.rxbytes/1024)), 50, yoffset, 74-50, 2, fontwdSml )
+                    oled_writetext( item.interface[0:8], 0, yoffset, fontwdSml )
+                    itemcount = itemcount - 1
+                    yoffset   = yoffset + 16
+
+                needsUpdate = True
+            else:
+                # Next Page due to error/no data
+                screenjogflag = 1
+
+        elif curscreen == "diskio":
+            # The busiest device, one page
+            if len(curlist) == 0:
+                try:
+                    diskio = snapshotcollector.get('diskio')
+                    if len(diskio) > 0:
+                        curlist = [max( diskio, key = lambda item: item.busy )]
+                except:
+                    logError( "Error processing data for DISKIO display")
+                    curlist = []
+            if len(curlist) > 0:
+                item = curlist.pop(0)
+
+                oled_clearbuffer()
+                oled_writetextaligned( "DISK I/O " + item.name[0:8], 0, 0, oledscreenwidth, 1, fontwdSml)
+                oled_writetext( "Busy", 0, 16, fontwdSml )
+                oled_writetextaligned( str(int(item.busy))+"%", 50, 16, oledscreenwidth-50, 2, fontwdSml )
+                oled_writetext( "IOPS", 0, 28, fontwdSml )
+                oled_writetextaligned( str(int(item.iops)), 50, 28, oledscreenwidth-50, 2, fontwdSml )
+                oled_writetext( "Await", 0, 40, fontwdSml )
+                oled_writetextaligned( str(argonsysinfo_truncateFloat(item.latency,1))+"ms", 50, 40, oledscreenwidth-50, 2, fontwdSml )
+                oled_writetext( "Queue", 0, 52, fontwdSml )
+                oled_writetextaligned( str(argonsysinfo_truncateFloat(item.queue,1)), 50, 52, oledscreenwidth-50, 2, fontwdSml )
+
+                needsUpdate = True
+            else:
+                # Next Page due to error/no data
+                screenjogflag = 1
+
         elif curscreen == "raid":
             # Raid Info
             if len(curlist) == 0:
                 try:
-                    tmpobj = argonsysinfo_listraid()
-                    curlist = tmpobj['raidlist']
+                    curlist = list(snapshotcollector.get('raid'))
                 except:
                     logError( "Error processing display of RAID information.")
                     curlist = []
             if len(curlist) > 0:
                 oled_loadbg("bgraid")
                 tmpitem = curlist.pop(0)
-                oled_writetextaligned(tmpitem["title"], 0, 0, stdleftoffset, 1, fontwdSml)
-                oled_writetextaligned(tmpitem["value"], 0, 8, stdleftoffset, 1, fontwdSml)
-                oled_writetextaligned(argonsysinfo_kbstr(tmpitem["info"]["size"]), 0, 56, stdleftoffset, 1, fontwdSml)
-                rebuild = tmpitem['info']['resync']
-                statusList = tmpitem['info']['state'].split(", ")
-                if len(statusList) == 1:
-                    status = statusList[0]
-                if len(statusList) == 2:
-                    status = statusList[1]
-                if len(statusList) >=3:
-                    status = statusList[2]
-                status = status.capitalize()
+                oled_writetextaligned(tmpitem.name, 0, 0, stdleftoffset, 1, fontwdSml)
+                oled_writetextaligned(tmpitem.level, 0, 8, stdleftoffset, 1, fontwdSml)
+                oled_writetextaligned(argonsysinfo_kbstr(tmpitem.sizekb), 0, 56, stdleftoffset, 1, fontwdSml)
+                rebuild = tmpitem.resync
+                status = tmpitem.status.capitalize()
                 oled_writetext( status, stdleftoffset, 8, fontwdSml )
                 if len(rebuild) > 0:
                     percent = rebuild.split( " " )
@@ -376,9 +488,9 @@ def display_loop(readq):
                     else:
                         label = "Rebuild: "
                     oled_writetext(label + percent[0], stdleftoffset, 16, fontwdSml)
-                oled_writetext("Active:"+str(int(tmpitem["info"]["active"]))+"/"+str(int(tmpitem["info"]["devices"])), stdleftoffset, 32, fontwdSml)
-                oled_writetext("Working:"+str(int(tmpitem["info"]["working"]))+"/"+str(int(tmpitem["info"]["devices"])), stdleftoffset, 40, fontwdSml)
-                oled_writetext("Failed:"+str(int(tmpitem["info"]["failed"]))+"/"+str(int(tmpitem["info"]["devices"])), stdleftoffset, 48, fontwdSml)
+                oled_writetext("Active:"+str(tmpitem.active)+"/"+str(tmpitem.devices), stdleftoffset, 32, fontwdSml)
+                oled_writetext("Working:"+str(tmpitem.working)+"/"+str(tmpitem.devices), stdleftoffset, 40, fontwdSml)
+                oled_writetext("Failed:"+str(tmpitem.failed)+"/"+str(tmpitem.devices), stdleftoffset, 48, fontwdSml)
                 needsUpdate = True
             else:
                 # Next page due to error/no data
@@ -388,10 +500,10 @@ def display_loop(readq):
             # RAM
             try:
                 oled_loadbg("bgram")
-                tmpraminfo = argonsysinfo_getram()
-                oled_writetextaligned(tmpraminfo["percent"]+"%", stdleftoffset, 8, oledscreenwidth-stdleftoffset, 1, fontwdReg)
+                tmpraminfo = snapshotcollector.get('memory')
+                oled_writetextaligned(str(tmpraminfo.percent)+"%", stdleftoffset, 8, oledscreenwidth-stdleftoffset, 1, fontwdReg)
                 oled_writetextaligned("of", stdleftoffset, 24, oledscreenwidth-stdleftoffset, 1, fontwdReg)
-                oled_writetextaligned(tmpraminfo["gb"]+"GB", stdleftoffset, 40, oledscreenwidth-stdleftoffset, 1, fontwdReg)
+                oled_writetextaligned(str(tmpraminfo.gb)+"GB", stdleftoffset, 40, oledscreenwidth-stdleftoffset, 1, fontwdReg)
                 needsUpdate = True
             except:
                 logError( "Error processing information for RAM display")
@@ -402,21 +514,14 @@ def display_loop(readq):
             # Temp
             try:
                 oled_loadbg("bgtemp")
-                hddtempctr = 0
-                maxcval = 0
-                mincval = 200
-
 
                 # Get min/max of hdd temp
-                hddtempobj = argonsysinfo_gethddtemp()
-                for curdev in hddtempobj:
-                    if hddtempobj[curdev] < mincval:
-                        mincval = hddtempobj[curdev]
-                    if hddtempobj[curdev] > maxcval:
-                        maxcval = hddtempobj[curdev]
-                    hddtempctr = hddtempctr + 1
-
-                cpucval = argonsysinfo_getcputemp()
+                temperatures = snapshotcollector.get('temperatures')
+                hddtempctr = len(temperatures.current)
+                maxcval = temperatures.hddmax
+                mincval = temperatures.hddmin
+
+                cpucval = temperatures.cpu
                 if hddtempctr > 0:
                     alltempobj = {"cpu": cpucval,"hdd min": mincval, "hdd max": maxcval}
                     # Update max C val to CPU Temp if necessary
@@ -478,7 +583,7 @@ def display_loop(readq):
             # IP Address
             try:
                 if len(curlist) == 0:
-                    curlist = argonsysinfo_getipList()
+                    curlist = list(snapshotcollector.get('network'))
             except:
                 logError( "Error processing information for IP display")
                 curlist = []
@@ -538,7 +643,17 @@ def display_loop(readq):
                 if readq.empty() == False:
                     qdata = readq.get()
 
-                if qdata == "OLEDSWITCH":
+                if qdata == "OLEDRAID" and "raid" in screenenabled:
+                    # RAID state changed, show it right away
+                    screenid = screenenabled.index("raid")
+                    curlist = []
+                    screenjogflag = 0
+                    # Reset Screen Saver
+                    screensavermode = False
+                    screensaverctr = 0
+
+                    break
+                elif qdata == "OLEDSWITCH":
                     # Trigger screen switch
                     screenjogflag = 1
                     # Reset Screen Saver
@@ -558,11 +673,13 @@ def display_loop(readq):
                         oled_reset()
                         oled_power(False)
 
-                    if timeoutcounter == 0:
-                        # Use 1 sec sleep get CPU usage
-                        cpuusagelist = argonsysinfo_listcpuusage(1)
-                    else:
-                        time.sleep(1)
+                    time.sleep(1)
+
+                    currentconfig.get()
+                    if configgeneration != currentconfig.generation:
+                        # The configuration changed, start again with the new screens
+                        screenjogflag = 0
+                        break
 
                     timeoutcounter = timeoutcounter + 1
                     if timeoutcounter >= 60 and screensavermode == False:
@@ -598,15 +715,25 @@ if len(sys.argv) > 1:
         # Starts the power button and temperature monitor threads
         try:
             logInfo( "argononed service version " + ARGON_VERSION + " starting.")
+            argoninventory_startwatch()
+            argonsysinfo_startcpusampler()
+            argonsysinfo_startiosampler()
+            argonsysinfo_startloadmonitor( load_sampled )
+            argonsysinfo_startthrottlemonitor( lambda: currentconfig.getfloat('FanControl', 'throttletemp'), throttle_changed, temp_sampled )
+            argonsysinfo_starthddtempservice()
+            argonsysinfo_startaddresswatch( lambda: snapshotcollector.invalidate( 'network' ) )
+            snapshotcollector.start()
             ipcq = Queue()
             t1 = Thread(target = shutdown_check, args =(ipcq, ))
 
             t2 = Thread(target = temp_check)
+            t4 = Thread(target = raid_check, args =(ipcq, ))
             if OLED_ENABLED == True:
                 t3 = Thread(target = display_loop, args =(ipcq, ))
 
             t1.start()
             t2.start()
+            t4.start()
             if OLED_ENABLED == True:
                 t3.start()
             ipcq.join()
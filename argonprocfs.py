@@ -0,0 +1,125 @@
+#!/usr/bin/python3
+
+#
+# Persistent readers for procfs and sysfs files.
+#
+# Rather than opening, reading and closing a file every time we sample it, each reader keeps the
+# descriptor open and re-reads it from offset 0 into a preallocated buffer.  The contents are
+# handed out as memoryview slices of that buffer, so a sample does not allocate per line.
+#
+
+import os
+import threading
+
+#
+class ProcFile:
+    """
+    A procfs/sysfs file that is kept open and re-read on demand.  The descriptor is only reopened
+    when a read fails (for instance a sysfs node that went away and came back).
+    """
+    def __init__( self, path, size = 4096 ):
+        self.path   = path
+        self.fd     = None
+        self.length = 0
+        self.buffer = bytearray( size )
+        self.view   = memoryview( self.buffer )
+
+    def open( self ):
+        self.fd = os.open( self.path, os.O_RDONLY | os.O_CLOEXEC )
+
+    def close( self ):
+        if self.fd is not None:
+            try:
+                os.close( self.fd )
+            except OSError:
+                ...
+            self.fd = None
+
+    def grow( self ):
+        """ Double the size of the buffer.  Views handed out earlier keep the old buffer alive, so we
+        create a new one rather than resizing in place.
+        """
+        newbuffer = bytearray( len(self.buffer) * 2 )
+        newbuffer[0:len(self.buffer)] = self.buffer
+        self.buffer = newbuffer
+        self.view   = memoryview( self.buffer )
+
+    def readall( self ):
+        length = 0
+        while True:
+            if length == len(self.buffer):
+                self.grow()
+            count = os.preadv( self.fd, [self.view[length:]], length )
+            if count == 0:
+                break
+            length += count
+        self.length = length
+        return self.view[0:length]
+
+    def read( self ):
+        """ Return the current contents of the file as a memoryview.  The view is only valid until
+        the next read.  Raises OSError if the file cannot be read, even after reopening it.
+        """
+        try:
+            if self.fd is None:
+                self.open()
+            return self.readall()
+        except OSError:
+            self.close()
+        self.open()
+        try:
+            return self.readall()
+        except OSError:
+            self.close()
+            raise
+
+    def lines( self ):
+        """ Read the file, and yield each line (without the newline) as a memoryview slice.
+        """
+        self.read()
+        buffer = self.buffer
+        length = self.length
+        start  = 0
+        while start < length:
+            end = buffer.find( b'\n', start, length )
+            if end < 0:
+                end = length
+            yield self.view[start:end]
+            start = end + 1
+
+    def readint( self ):
+        """ Read a sysfs attribute holding a single integer.
+        """
+        self.read()
+        return int( self.buffer[0:self.length] )
+
+    def readstr( self ):
+        """ Read a sysfs attribute holding a single word.
+        """
+        self.read()
+        return self.buffer[0:self.length].decode().strip()
+
+readers = threading.local()
+
+#
+def argonprocfs_reader( path ):
+    """ Return the persistent reader for path.  Readers are kept per thread, so the OLED and fan
+    threads never overwrite each other's buffer in the middle of parsing.
+    """
+    try:
+        cache = readers.cache
+    except AttributeError:
+        cache = readers.cache = {}
+    reader = cache.get( path )
+    if reader is None:
+        reader = cache[path] = ProcFile( path )
+    return reader
+
+#
+def argonprocfs_forget( path ):
+    """ Close and drop the reader for path in this thread, used when a device goes away.
+    """
+    cache = getattr( readers, "cache", {} )
+    reader = cache.pop( path, None )
+    if reader is not None:
+        reader.close()
@@ -0,0 +1,110 @@
+#!/usr/bin/python3
+
+#
+# Rates from counters.
+#
+# The kernel hands out running totals (sectors read, bytes received, jiffies spent idle ...) and we
+# want rates.  A RateTracker keeps the previous counters of every device, keyed by name, and works
+# out the rates for all of them in one pass over the new counters, so the cost grows linearly with
+# the number of devices.  Devices that appear are picked up on the next update, devices that go
+# away are dropped, and a counter that wraps or resets never produces a bogus rate.
+#
+
+import os
+import math
+import time
+from array import array
+
+COUNTER32 = 1 << 32
+
+#
+def argonrates_kernel32():
+    """ Whether the kernel is 32 bit, which is what sets the width of its unsigned long counters.
+    This has to come from the kernel rather than the interpreter, since a 32 bit Raspberry Pi OS
+    runs its 32 bit userland on a 64 bit kernel by default.
+    """
+    machine = os.uname().machine
+    return not (machine.endswith( "64" ) or machine == "s390x")
+
+#
+# Whether the kernel's unsigned long counters are 32 bits wide, and can therefore wrap
+#
+WRAPS32 = argonrates_kernel32()
+
+#
+def argonrates_delta( new, old ):
+    """ How much a counter went up from old to new.  Many kernel counters are an unsigned long,
+    which is 32 bits on a 32 bit kernel, so there a counter that went backwards from the top half of
+    the 32 bit range has wrapped.  Any other counter that went backwards (and on a 64 bit kernel,
+    every one) was reset (the device was replaced, or the driver reloaded), and None is returned
+    since there is no way to tell how far it went.
+    """
+    if new >= old:
+        return new - old
+    if WRAPS32 and COUNTER32 >> 1 <= old < COUNTER32:
+        return new + COUNTER32 - old
+    return None
+
+#
+class RateTracker:
+    """
+    Per second rates for a set of counters of each device.  update() takes a dictionary of device
+    name to a sequence of width counters, and afterwards:
+
+        rates    - the rates over the last interval, device name to an array of width floats
+        averages - the exponentially weighted moving average of the rates, with a time constant of
+                   tau seconds
+        stamp    - the time.monotonic() of the last update
+        span     - the length, in seconds, of the last interval
+
+    A device only has rates once it has been seen twice.  Both dictionaries are replaced on every
+    update, never changed, so other threads can read them without locking.
+    """
+    def __init__( self, width, tau = 5 ):
+        self.width    = width
+        self.tau      = tau
+        self.counters = {}
+        self.rates    = {}
+        self.averages = {}
+        self.stamp    = None
+        self.span     = 0
+
+    def update( self, counters, now = None ):
+        if now is None:
+            now = time.monotonic()
+        if self.stamp is not None and now <= self.stamp:
+            return self.rates
+        span = 0
+        if self.stamp is not None:
+            span = now - self.stamp
+        alpha = 1
+        if span > 0 and self.tau > 0:
+            alpha = 1 - math.exp( -span/self.tau )
+
+        stored   = {}
+        rates    = {}
+        averages = {}
+        for name, values in counters.items():
+            new = array( 'Q', values )
+            stored[name] = new
+            old = self.counters.get( name )
+            if old is None or span == 0:
+                continue
+            deltas = [argonrates_delta( n, o ) for n, o in zip( new, old )]
+            if None in deltas:
+                # Start this device again from these counters
+                continue
+            rate = array( 'd', [d/span for d in deltas] )
+            rates[name] = rate
+            average = self.averages.get( name )
+            if average is None:
+                averages[name] = rate
+            else:
+                averages[name] = array( 'd', [a + alpha*(r - a) for a, r in zip( average, rate )] )
+
+        self.counters = stored
+        self.rates    = rates
+        self.averages = averages
+        self.stamp    = now
+        self.span     = span
+        return rates
@@ -0,0 +1,260 @@
+#!/usr/bin/python3
+
+#
+# A shared snapshot of the state of the system.
+#
+# Rather than the fan thread, the OLED and argon-status each calling the argonsysinfo functions on
+# their own, one collector refreshes each part of the snapshot at its own interval, and everyone
+# reads the latest snapshot.  The records are immutable tuples holding plain numbers, so reading
+# them needs no copying, and formatting is left to whoever displays them.
+#
+
+import time
+import threading
+from typing import NamedTuple, Tuple
+from argonsysinfo import *
+
+#
+class CPUUsage(NamedTuple):
+    name    : str
+    percent : int
+
+#
+class MemoryInfo(NamedTuple):
+    totalkb : int
+    freekb  : int
+
+    @property
+    def percent( self ):
+        """ Percentage of memory that is free """
+        if self.totalkb == 0:
+            return 0
+        return int(100*self.freekb/self.totalkb)
+
+    @property
+    def gb( self ):
+        """ Total memory, rounded to the nearest GB """
+        return (self.totalkb+512*1024)>>20
+
+#
+class DiskUsage(NamedTuple):
+    name    : str
+    mapper  : str
+    totalkb : int
+    usedkb  : int
+    percent : float
+
+#
+class DiskRate(NamedTuple):
+    name    : str
+    readkb  : float    # per second
+    writekb : float
+    iops    : float
+    latency : float    # average ms per I/O, including queueing (await)
+    queue   : float    # average number of I/Os outstanding
+    busy    : float    # percent of the time with I/O outstanding
+
+#
+class DriveTemp(NamedTuple):
+    name    : str
+    celsius : float
+    age     : int = 0    # seconds since the drive was read
+
+    @property
+    def current( self ):
+        """ Whether the reading is recent enough to count towards the fan speed """
+        return self.age <= HDDTEMP_MAXAGE
+
+#
+class Temperatures(NamedTuple):
+    cpu    : float
+    drives : Tuple[DriveTemp, ...]
+
+    @property
+    def current( self ):
+        """ The drives with a current reading, a drive that has been asleep for a while is left out """
+        return tuple( d for d in self.drives if d.current )
+
+    @property
+    def hddmax( self ):
+        """ Hottest drive with a current reading, or 0 if there are none """
+        return max( [d.celsius for d in self.current], default = 0 )
+
+    @property
+    def hddmin( self ):
+        """ Coolest drive with a current reading, or 0 if there are none """
+        return min( [d.celsius for d in self.current], default = 0 )
+
+#
+class RaidArray(NamedTuple):
+    name    : str
+    level   : str
+    state   : str
+    sizekb  : int
+    devices : int
+    active  : int
+    working : int
+    failed  : int
+    spare   : int
+    resync  : str
+    members : Tuple[str, ...]
+
+    @property
+    def status( self ):
+        """ The most interesting part of the state, i.e. "recovering" from "clean, degraded, recovering" """
+        statelist = self.state.split( ", " )
+        return statelist[min(len(statelist), 3)-1]
+
+#
+class NetAddress(NamedTuple):
+    interface : str
+    address   : str
+
+#
+class NetRate(NamedTuple):
+    interface : str
+    rxbytes   : float    # per second
+    txbytes   : float
+    rxpackets : float
+    txpackets : float
+
+#
+class SystemSnapshot:
+    """
+    The latest known state of the system.  A snapshot is never modified once published, a refresh
+    builds a new one that shares the records that did not change.
+    """
+    __slots__ = ('stamp', 'cpu', 'memory', 'disks', 'temperatures', 'raid', 'network', 'throughput',
+                 'bandwidth', 'diskio')
+
+    def __init__( self, **fields ):
+        for name in self.__slots__:
+            setattr( self, name, fields.get( name ) )
+
+    def replace( self, **changes ):
+        fields = {name: getattr( self, name ) for name in self.__slots__}
+        fields.update( changes )
+        return SystemSnapshot( **fields )
+
+#
+def argonsnapshot_cpu():
+    usage = argonsysinfo_getcpuusage()
+    if usage is None:
+        usage = {d['title']: d['value'] for d in argonsysinfo_listcpuusage()}
+    return tuple( CPUUsage(name, usage[name]) for name in usage if name != "cpu" )
+
+#
+def argonsnapshot_memory():
+    return MemoryInfo( *argonsysinfo_getmeminfo() )
+
+#
+def argonsnapshot_disks():
+    devices = argonsysinfo_listhddusage()
+    return tuple( DiskUsage(dev, devices[dev].get('mapper'), devices[dev]['total'], devices[dev]['used'], devices[dev]['percent'])
+                  for dev in devices )
+
+#
+def argonsnapshot_temperatures():
+    drives = argonsysinfo_gethddreadings()
+    return Temperatures( argonsysinfo_getcputemp(), tuple( DriveTemp(dev, *drives[dev]) for dev in drives ) )
+
+#
+def argonsnapshot_raid( raidlist ):
+    """ Convert the result of argonsysinfo_listraid() into RaidArray records """
+    return tuple( RaidArray( item['title'], item['info']['raidtype'], item['info']['state'],
+                             item['info']['size'], item['info']['devices'], item['info']['active'],
+                             item['info']['working'], item['info']['failed'], item['info']['spare'],
+                             item['info']['resync'], tuple( item['info']['hddlist'] ) )
+                  for item in raidlist['raidlist'] )
+
+#
+def argonsnapshot_network():
+    return tuple( NetAddress( *item ) for item in argonsysinfo_getipList() )
+
+#
+def argonsnapshot_throughput():
+    rates = argonsysinfo_getiorates()['network']
+    return tuple( NetRate( name, *rates[name] ) for name in sorted( rates ) )
+
+#
+def argonsnapshot_diskrate( name, rate ):
+    if rate is None:
+        return DiskRate( name, 0, 0, 0, 0, 0, 0 )
+    return DiskRate( name, rate[0]/2, rate[1]/2, *argonsysinfo_diskmetrics( rate ) )
+
+#
+def argonsnapshot_bandwidth( disks ):
+    """ The rates of the disks in a disks record, that is of the mounted file systems """
+    rates = argonsysinfo_getiorates()['disks']
+    return tuple( argonsnapshot_diskrate( disk.name, rates.get( disk.mapper or disk.name ) ) for disk in disks )
+
+#
+def argonsnapshot_diskio():
+    """ The rates of every whole storage device, RAID members included """
+    rates = argonsysinfo_getiorates()['disks']
+    return tuple( argonsnapshot_diskrate( device.disk, rates.get( device.name ) )
+                  for device in sorted( argoninventory_get().devices.values() )
+                  if device.storage and not device.partition )
+
+#
+# The functions that collect each part of the snapshot which needs nothing from the collector
+#
+snapshotcollectors = {'cpu': argonsnapshot_cpu, 'memory': argonsnapshot_memory, 'disks': argonsnapshot_disks,
+                      'temperatures': argonsnapshot_temperatures, 'network': argonsnapshot_network,
+                      'throughput': argonsnapshot_throughput, 'diskio': argonsnapshot_diskio}
+
+#
+class SnapshotCollector( threading.Thread ):
+    """
+    Keeps a SystemSnapshot up to date, refreshing each part at its own interval (in seconds).
+    Consumers read collector.snapshot, or use get() which collects a part on the spot if it has
+    never been collected (which is all argon-status needs, it never starts the thread).
+    """
+    intervals = {'cpu': 1, 'memory': 5, 'temperatures': 5, 'disks': 30, 'raid': 30, 'network': 30, 'throughput': 1,
+                 'bandwidth': 1, 'diskio': 1}
+
+    def __init__( self, raiddetail = False ):
+        super().__init__( name = "snapshot", daemon = True )
+        self.raiddetail = raiddetail
+        self.snapshot   = SystemSnapshot( stamp = time.monotonic() )
+        self.deadlines  = {name: 0 for name in self.intervals}
+        self.lock       = threading.Lock()
+
+    def collectfield( self, name ):
+        if name == 'raid':
+            return argonsnapshot_raid( argonsysinfo_listraid( self.raiddetail ) )
+        if name == 'bandwidth':
+            return argonsnapshot_bandwidth( self.get( 'disks' ) )
+        return snapshotcollectors[name]()
+
+    def update( self, name, record ):
+        """ Publish a new record for part of the snapshot """
+        with self.lock:
+            self.snapshot = self.snapshot.replace( stamp = time.monotonic(), **{name: record} )
+            self.deadlines[name] = time.monotonic() + self.intervals[name]
+
+    def collect( self, name ):
+        self.update( name, self.collectfield( name ) )
+
+    def get( self, name ):
+        record = getattr( self.snapshot, name )
+        if record is None:
+            self.collect( name )
+            record = getattr( self.snapshot, name )
+        return record
+
+    def invalidate( self, name ):
+        """ Have a part refreshed on the next tick """
+        self.deadlines[name] = 0
+
+    def run( self ):
+        while True:
+            now = time.monotonic()
+            for name in self.intervals:
+                if self.deadlines[name] <= now:
+                    try:
+                        self.collect( name )
+                    except Exception:
+                        # Try again next interval
+                        self.deadlines[name] = now + self.intervals[name]
+            time.sleep( 1 )
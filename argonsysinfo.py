@@ -6,12 +6,59 @@
 
 import os
 import time
+import json
+import codecs
 import socket
-import psutil
+import select
+import threading
 from pathlib import Path
+from collections import deque
+from argonprocfs import *
+from argonparse import *
+from argonhddtemp import *
+from argonfan import *
+from argoninventory import *
+from argonnetlink import *
+from argonrates import *
+from argonthrottle import *
+from argonload import *
 
 fanspeed = Path('/tmp/fanspeed.txt')
 
+#
+# What the daemon publishes for argon-status.  Some of it is rewritten every second, so it lives in
+# /run, which is always tmpfs, rather than /tmp, which may be on the SD card.
+#
+publishdir = Path('/run/argoneon')
+cpuusage = publishdir / 'cpuusage.json'
+hddtemp  = publishdir / 'hddtemp.json'
+raidstate = publishdir / 'raid.json'
+iorates   = publishdir / 'iorates.json'
+throttlestate = publishdir / 'throttle.json'
+fancontrolstate = publishdir / 'fancontrol.json'
+
+#
+# How long (in seconds) a SMART temperature reading is considered current, which is the once a
+# minute the drives have always been polled at, and how old the readings published by the daemon
+# may be before argon-status runs smartctl itself.
+#
+HDDTEMP_TTL = 60
+HDDTEMP_PUBLISHED_TTL = 120
+
+#
+# How old (in seconds) a drive temperature may be and still count towards the fan speed.  A drive
+# that is asleep is not read, so its last reading is still shown but stops driving the fan once it
+# is this old.  Idle drives that are still spinning are read often enough never to get this old.
+#
+HDDTEMP_MAXAGE = IDLE_MAXTTL + 120
+
+#
+# How old the fan control decisions published by the daemon may be, which has to be longer than
+# the longest wait between fan checks, plus the time a check itself can take (spinning the fan up
+# takes a second, and a smartctl poll can take many more).
+#
+FANCONTROL_PUBLISHED_TTL = FAN_MAXINTERVAL + 60
+
 def checkPermission():
     """
     Determine if the user can properly execute the script.  Must have sudo or be root
@@ -42,57 +89,149 @@ def argonsysinfo_recordCurrentFanSpeed( theSpeed ):
     except:
         ...
 
+#
+def argonsysinfo_publish( thePath, theData ):
+    """ Record data (as JSON) for external applications such as argon-status to use.  The data is
+    written to a temporary file and renamed, so a reader never sees a partially written file.
+    """
+    try:
+        thePath.parent.mkdir( exist_ok = True )
+        tmpPath = thePath.with_name( thePath.name + ".tmp" )
+        tmpPath.write_text( json.dumps( {"time": time.time(), "data": theData} ) )
+        os.replace( tmpPath, thePath )
+    except:
+        ...
+
+#
+def argonsysinfo_readpublished( thePath, maxage ):
+    """ Read data published by argonsysinfo_publish(), provided it is no older than maxage seconds.
+    Returns None if the data is missing or stale.
+    """
+    try:
+        published = json.loads( thePath.read_text() )
+        if time.time() - published["time"] <= maxage:
+            return published["data"]
+    except (FileNotFoundError, ValueError, KeyError, TypeError):
+        ...
+    return None
+
+#
+def argonsysinfo_cpuusagedelta( curusage_a, curusage_b ):
+    """ Compute the CPU usage percentages between two /proc/stat snapshots.  The result is keyed
+    by cpu name, and includes the aggregate "cpu" entry as well as each core.
+    """
+    output = {}
+    for cpuname in curusage_b:
+        if cpuname not in curusage_a:
+            continue
+        total = argonrates_delta( curusage_b[cpuname]["total"], curusage_a[cpuname]["total"] )
+        # iowait is allowed to go backwards, which can take idle with it
+        idle = argonrates_delta( curusage_b[cpuname]["idle"], curusage_a[cpuname]["idle"] ) or 0
+        if not total:
+            output[cpuname] = 0
+        else:
+            output[cpuname] = max( 0, int(100*(total-idle)/(total)) )
+    return output
+
+#
+class CPUUsageSampler( threading.Thread ):
+    """
+    Background thread that takes a /proc/stat snapshot every interval seconds and keeps the most
+    recent ones in a ring.  Usage queries are answered from the ring, so nobody has to sleep while
+    waiting for a second snapshot.  The window (in seconds) controls how far back the usage is
+    computed from.
+    """
+    def __init__( self, interval = 1, window = 1, depth = 60, publish = True ):
+        super().__init__( name = "cpusampler", daemon = True )
+        self.interval = interval
+        self.window   = window
+        self.publish  = publish
+        self.ring     = deque( maxlen = max( depth, 2 ) )
+        self.lock     = threading.Lock()
+
+    def run( self ):
+        while True:
+            snapshot = argonsysinfo_getcpuusagesnapshot()
+            with self.lock:
+                self.ring.append( (time.monotonic(), snapshot) )
+            if self.publish:
+                usage = self.usage()
+                if usage is not None:
+                    argonsysinfo_publish( cpuusage, usage )
+            time.sleep( self.interval )
+
+    def usage( self, window = None ):
+        """ Return the usage over the last window seconds, or None if we do not have two snapshots
+        yet.
+        """
+        if window is None:
+            window = self.window
+        with self.lock:
+            if len(self.ring) < 2:
+                return None
+            newstamp, newest = self.ring[-1]
+            for stamp, snapshot in reversed(self.ring):
+                oldest = snapshot
+                if newstamp - stamp >= window:
+                    break
+        return argonsysinfo_cpuusagedelta( oldest, newest )
+
+cpusampler = None
+
+#
+def argonsysinfo_startcpusampler( interval = 1, window = 1 ):
+    """ Start the background CPU sampler, if it is not already running.  The sampler publishes its
+    results so other processes (argon-status) can pick them up without waiting.
+    """
+    global cpusampler
+    if cpusampler is None:
+        cpusampler = CPUUsageSampler( interval, window )
+        cpusampler.start()
+    return cpusampler
+
+#
+def argonsysinfo_getcpuusage( window = None ):
+    """ Return the CPU usage from the background sampler, either the one running in this process
+    or the one published by the daemon.  Returns None if neither is available.
+    """
+    if cpusampler is not None:
+        usage = cpusampler.usage( window )
+        if usage is not None:
+            return usage
+    return argonsysinfo_readpublished( cpuusage, 5 )
+
 def argonsysinfo_listcpuusage(sleepsec = 1):
     outputlist = []
-    curusage_a = argonsysinfo_getcpuusagesnapshot()
-    time.sleep(sleepsec)
-    curusage_b = argonsysinfo_getcpuusagesnapshot()
+    usage = argonsysinfo_getcpuusage()
+    if usage is None:
+        # No sampler available, take two snapshots ourselves
+        curusage_a = argonsysinfo_getcpuusagesnapshot()
+        time.sleep(sleepsec)
+        curusage_b = argonsysinfo_getcpuusagesnapshot()
+        usage = argonsysinfo_cpuusagedelta( curusage_a, curusage_b )
 
-    for cpuname in curusage_a:
+    for cpuname in usage:
         if cpuname == "cpu":
             continue
-        if curusage_a[cpuname]["total"] == curusage_b[cpuname]["total"]:
-            outputlist.append({"title": cpuname, "value": "0%"})
-        else:
-            total = curusage_b[cpuname]["total"]-curusage_a[cpuname]["total"]
-            idle = curusage_b[cpuname]["idle"]-curusage_a[cpuname]["idle"]
-            outputlist.append({"title": cpuname, "value": int(100*(total-idle)/(total))})
+        outputlist.append({"title": cpuname, "value": usage[cpuname]})
     return outputlist
 
 def argonsysinfo_getcpuusagesnapshot():
     cpupercent = {}
     errorflag = False
     try:
-        cpuctr = 0
         # user, nice, system, idle, iowait, irc, softirq, steal, guest, guest nice
-        tempfp = open("/proc/stat", "r")
-        alllines = tempfp.readlines()
-        for temp in alllines:
-            temp = temp.replace('\t', ' ')
-            temp = temp.strip()
-            while temp.find("  ") >= 0:
-                temp = temp.replace("  ", " ")
-            if len(temp) < 3:
-                cpuctr = cpuctr +1
-                continue
-
-            checkname = temp[0:3]
-            if checkname == "cpu":
-                infolist = temp.split(" ")
-                idle = 0
-                total = 0
-                colctr = 1
-                while colctr < len(infolist):
-                    curval = int(infolist[colctr])
-                    if colctr == 4 or colctr == 5:
-                        idle = idle + curval
-                    total = total + curval
-                    colctr = colctr + 1
-                if total > 0:
-                    cpupercent[infolist[0]] = {"total": total, "idle": idle}
-            cpuctr = cpuctr +1
-
-        tempfp.close()
+        for line in argonprocfs_reader("/proc/stat").lines():
+            if line[0:3] != b"cpu":
+                # The cpu lines come first, nothing after them is of interest
+                break
+            infolist = argonparse_fields(line)
+            idle = int(infolist[4]) + int(infolist[5])
+            total = 0
+            for curval in infolist[1:]:
+                total = total + int(curval)
+            if total > 0:
+                cpupercent[infolist[0].decode()] = {"total": total, "idle": idle}
     except IOError:
         errorflag = True
     return cpupercent
@@ -100,63 +239,24 @@ def argonsysinfo_getcpuusagesnapshot():
 
 def argonsysinfo_liststoragetotal():
     outputlist = []
-    ramtotal = 0
-    errorflag = False
-
-    try:
-        hddctr = 0
-        tempfp = open("/proc/partitions", "r")
-        alllines = tempfp.readlines()
-
-        for temp in alllines:
-            temp = temp.replace('\t', ' ')
-            temp = temp.strip()
-            while temp.find("  ") >= 0:
-                temp = temp.replace("  ", " ")
-            infolist = temp.split(" ")
-            if len(infolist) >= 4:
-                # Check if header
-                if infolist[3] != "name":
-                    parttype = infolist[3][0:3]
-                    if parttype == "ram":
-                        ramtotal = ramtotal + int(infolist[2])
-                    elif parttype[0:2] == "sd" or parttype[0:2] == "hd":
-                        lastchar = infolist[3][-1]
-                        if lastchar.isdigit() == False:
-                            outputlist.append({"title": infolist[3], "value": argonsysinfo_kbstr(int(infolist[2]))})
-                    else:
-                        # SD Cards
-                        lastchar = infolist[3][-2]
-                        if lastchar[0] != "p":
-                            outputlist.append({"title": infolist[3], "value": argonsysinfo_kbstr(int(infolist[2]))})
-
-        tempfp.close()
-        #outputlist.append({"title": "ram", "value": argonsysinfo_kbstr(ramtotal)})
-    except IOError:
-        errorflag = True
+    for device in argoninventory_get().devices.values():
+        if device.partition or not device.storage:
+            continue
+        outputlist.append({"title": device.name, "value": argonsysinfo_kbstr(device.sizekb)})
     return outputlist
 
-def argonsysinfo_getram():
-    totalram = 0
-    totalfree = 0
-    tempfp = open("/proc/meminfo", "r")
-    alllines = tempfp.readlines()
+def argonsysinfo_getmeminfo():
+    """ Return the total and free (free + buffers + cached) memory in KB.  The total comes from the
+    inventory, only the free counters are read each time.
+    """
+    meminfo = argonparse_keyvalues(argonprocfs_reader("/proc/meminfo").lines(),
+                                   [b"MemFree:", b"Buffers:", b"Cached:"])
+    totalram = argoninventory_get().memtotal
+    totalfree = int(meminfo.get(b"MemFree:", 0)) + int(meminfo.get(b"Buffers:", 0)) + int(meminfo.get(b"Cached:", 0))
+    return (totalram, totalfree)
 
-    for temp in alllines:
-        temp = temp.replace('\t', ' ')
-        temp = temp.strip()
-        while temp.find("  ") >= 0:
-            temp = temp.replace("  ", " ")
-        infolist = temp.split(" ")
-        if len(infolist) >= 2:
-            if infolist[0] == "MemTotal:":
-                totalram = int(infolist[1])
-            elif infolist[0] == "MemFree:":
-                totalfree = totalfree + int(infolist[1])
-            elif infolist[0] == "Buffers:":
-                totalfree = totalfree + int(infolist[1])
-            elif infolist[0] == "Cached:":
-                totalfree = totalfree + int(infolist[1])
+def argonsysinfo_getram():
+    totalram, totalfree = argonsysinfo_getmeminfo()
     if totalram == 0:
         return {'percent': '0', 'gb': '0'}
     return {'percent': str(int(100*totalfree/totalram)), 'gb': str((totalram+512*1024)>>20)}
@@ -165,100 +265,197 @@ def argonsysinfo_getram():
 def argonsysinfo_getmaxhddtemp():
     maxtempval = 0
     try:
-        hddtempobj = argonsysinfo_gethddtemp()
-        for curdev in hddtempobj:
-            if hddtempobj[curdev] > maxtempval:
-                maxtempval = hddtempobj[curdev]
+        readings = argonsysinfo_gethddreadings()
+        for curdev in readings:
+            theTemp, age = readings[curdev]
+            if age <= HDDTEMP_MAXAGE and theTemp > maxtempval:
+                maxtempval = theTemp
         return maxtempval
     except:
         return maxtempval
 
+throttlemonitor = None
+
+#
+def argonsysinfo_startthrottlemonitor( warntemp = 75.0, onchange = None, onsample = None ):
+    """ Start watching for CPU throttling, if we are not already.  warntemp may be a callable, see
+    ThrottleMonitor.  The monitor publishes what it sees every second for argon-status, and then
+    hands it to onsample if given.
+    """
+    global throttlemonitor
+    def sampled( status ):
+        argonsysinfo_publish( throttlestate, status )
+        if onsample is not None:
+            onsample( status )
+
+    if throttlemonitor is None:
+        throttlemonitor = ThrottleMonitor( warntemp = warntemp, onchange = onchange, onsample = sampled )
+        throttlemonitor.start()
+    return throttlemonitor
+
+#
+def argonsysinfo_getthrottle():
+    """ Return the throttling status from the monitor, either the one running in this process or
+    the one published by the daemon.  Without either, the current flags are read once, and there
+    is no event history.
+    """
+    if throttlemonitor is not None:
+        return throttlemonitor.status()
+    status = argonsysinfo_readpublished( throttlestate, 5 )
+    if status is None:
+        monitor = ThrottleMonitor()
+        monitor.sample()
+        status = monitor.status()
+    return status
+
+#
+def argonsysinfo_getfancontrol():
+    """ Return the last decision of the daemon's fan thread: the mode, the fan speed, how long it is
+    waiting until the next check, why, and how fast the temperature is rising (degrees a minute).
+    None if the daemon is not publishing it.
+    """
+    return argonsysinfo_readpublished( fancontrolstate, FANCONTROL_PUBLISHED_TTL )
+
 def argonsysinfo_getcputemp():
     try:
-        tempfp = open("/sys/class/thermal/thermal_zone0/temp", "r")
-        temp = tempfp.readline()
-        tempfp.close()
-        return float(int(temp)/1000)
-    except IOError:
+        return float(argonprocfs_reader("/sys/class/thermal/thermal_zone0/temp").readint()/1000)
+    except (IOError, ValueError):
         return 0
 
+hddtempservice = None
+
+#
+def argonsysinfo_listsmartdisks():
+    """ The disks we ask smartctl about, from the inventory """
+    return sorted( argoninventory_get().disks( ("sd", "hd") ) )
+
+#
+def argonsysinfo_listiocounts():
+    """ The number of I/Os each block device has completed, so idle drives can be left alone.  When
+    the I/O sampler is running this comes from its last /proc/diskstats read.
+    """
+    diskstats = None
+    if iosampler is not None:
+        diskstats = iosampler.diskstats
+    if diskstats is None:
+        diskstats = argonsysinfo_diskstats()
+    return {name: diskstats[name]['reads'] + diskstats[name]['writes'] for name in diskstats}
+
+#
+def argonsysinfo_starthddtempservice( ttl = HDDTEMP_TTL ):
+    """ Create the shared SMART temperature service for this process.  The daemon uses this, and
+    publishes every refresh so argon-status can use the results instead of running smartctl again.
+    """
+    global hddtempservice
+    if hddtempservice is None:
+        hddtempservice = SmartTempService( ttl, onupdate = lambda readings: argonsysinfo_publish( hddtemp, readings ),
+                                           listdisks = argonsysinfo_listsmartdisks,
+                                           iocounters = argonsysinfo_listiocounts )
+    return hddtempservice
+
+#
+def argonsysinfo_gethddreadings():
+    """ Return a dictionary of device name to (temperature in C, age of the reading in seconds),
+    from the daemon if it has published them recently, otherwise by asking the drives.
+    """
+    if hddtempservice is None:
+        outputobj = argonsysinfo_readpublished( hddtemp, HDDTEMP_PUBLISHED_TTL )
+        if outputobj is not None:
+            try:
+                return {device: (float(outputobj[device][0]), int(outputobj[device][1])) for device in outputobj}
+            except (IndexError, TypeError, ValueError):
+                # Published by an older daemon
+                ...
+        # No daemon to ask, so run smartctl from here
+        service = SmartTempService( HDDTEMP_TTL, listdisks = argonsysinfo_listsmartdisks )
+    else:
+        service = hddtempservice
+    return service.readings()
+
 def argonsysinfo_gethddtemp():
-    outputobj = {}
-    hddtempcmd = "/usr/sbin/smartctl"
-    #smartctl -d sat -A ${device} | grep 194 | awk -F" " '{print $10}'
-
-    if os.path.exists(hddtempcmd):
-        # try:
-            command = os.popen("lsblk | grep -e '0 disk' | awk '{print $1}'")
-            tmp = command.read()
-            command.close()
-            alllines = [l for l in tmp.split("\n") if l]
-            for curdev in alllines:
-                if curdev[0:2] == "sd" or curdev[0:2] == "hd":
-                    # command = os.popen(hddtempcmd+" -d sat -A /dev/"+curdev+" | grep 194 | awk '{print $10}' 2>&1")
-                    def getSmart(smartCmd):
-                        if not checkPermission() and not smartCmd.startswith("sudo"):
-                            smartCmd = "sudo " + smartCmd
-                        try:
-                            command = os.popen(smartCmd)
-                            smartctlOutRaw = command.read()
-                        except Exception as e:
-                            print (e)
-                        finally:
-                            command.close()
-                        if 'scsi error unsupported scsi opcode' in smartctlOutRaw:
-                            return None
-
-                        smartctlOut = [l for l in smartctlOutRaw.split('\n') if l]
-
-                        for smartAttr in ["194","190"]:
-                            try:
-                                line = [l for l in smartctlOut if l.startswith(smartAttr)][0]
-                                parts = [p for p in line.replace('\t',' ').split(' ') if p]
-                                tempval = float(parts[9])
-                                return tempval
-                            except IndexError:
-                                ## Smart Attr not found
-                                ...
-
-                        for smartAttr in ["Temperature:"]:
-                            try:
-                                line = [l for l in smartctlOut if l.startswith(smartAttr)][0]
-                                parts = [p for p in line.replace('\t',' ').split(' ') if p]
-                                tempval = float(parts[1])
-                                return tempval
-                            except IndexError:
-                                ## Smart attrbute not found
-                                ...
-                        return None
-                    theTemp = getSmart(f"{hddtempcmd} -d sat -n standby,0 -A /dev/{curdev}")
-                    if theTemp:
-                        outputobj[curdev] = theTemp
-                    else: 
-                        theTemp = getSmart(f"{hddtempcmd} -n standby,0 -A /dev/{curdev}")
-                        if theTemp:
-                            outputobj[curdev] = theTemp
-    return outputobj
+    readings = argonsysinfo_gethddreadings()
+    return {device: readings[device][0] for device in readings}
+
+addresstable = None
+
+#
+def argonsysinfo_startaddresswatch( onchange = None ):
+    """ Keep a table of the interface addresses, current from rtnetlink notifications, for long
+    running processes.  onchange is called whenever an address comes or goes.
+    """
+    global addresstable
+    if addresstable is None:
+        try:
+            addresstable = AddressTable( onchange )
+            addresstable.start()
+        except OSError:
+            addresstable = None
+    return addresstable
+
+#
+def argonsysinfo_listaddresses():
+    """ Return (interface, family, address) for every address on every interface """
+    if addresstable is not None:
+        return addresstable.addresses
+    try:
+        table = argonnetlink_dumpaddresses()
+        return tuple( (table[key], key[1], key[2]) for key in sorted( table ) )
+    except OSError:
+        # No netlink, fall back to psutil
+        import psutil
+        return tuple( (interface, snic.family, snic.address)
+                      for interface, snics in psutil.net_if_addrs().items() for snic in snics )
+
+#
+def argonsysinfo_getdefaultinterface():
+    """ The interface the IPv4 default route with the lowest metric goes through, from
+    /proc/net/route, or None if there is no default route.
+    """
+    best = None
+    try:
+        for line in argonprocfs_reader("/proc/net/route").lines():
+            # Iface Destination Gateway Flags RefCnt Use Metric Mask ...
+            fields = argonparse_fields(line)
+            if len(fields) < 8 or fields[1] != b"00000000" or fields[7] != b"00000000":
+                continue
+            try:
+                if not int(fields[3], 16) & 0x1:
+                    # Not RTF_UP
+                    continue
+                metric = int(fields[6])
+            except ValueError:
+                continue
+            if best is None or metric < best[0]:
+                best = (metric, fields[0].decode())
+    except IOError:
+        ...
+    if best is None:
+        return None
+    return best[1]
 
 def argonsysinfo_getip():
-    ipaddr = ""
-    st = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    try: 
-        # Connect to nonexistent device
-        st.connect(('254.255.255.255', 1))
-        ipaddr = st.getsockname()[0]
-    except Exception:
-        ipaddr = 'N/A'
-    finally:
-        st.close()
-    return ipaddr
+    """ The IPv4 address of the interface the default route goes through, which is the address the
+    box is normally reached at, or the first address we report on if there is no default route.
+    """
+    interface = argonsysinfo_getdefaultinterface()
+    for name, family, address in argonsysinfo_listaddresses():
+        if name == interface and family == socket.AF_INET:
+            return address
+    iplist = argonsysinfo_getipList()
+    if len(iplist) == 0:
+        return 'N/A'
+    return iplist[0][1]
+
+#
+def argonsysinfo_showinterface( interface ):
+    """ The interfaces we report on, everything except loopback and bridges """
+    return interface != "lo" and not interface.startswith("br")
 
 def get_ip_addresses( family ):
-    for interface, snics in psutil.net_if_addrs().items():
-        if interface != "lo" and not interface.startswith("br"):
-            for snic in snics:
-                if snic.family == family:
-                    yield( interface, snic.address )
+    for interface, addrfamily, address in argonsysinfo_listaddresses():
+        if argonsysinfo_showinterface( interface ):
+            if addrfamily == family:
+                yield( interface, address )
 
 def argonsysinfo_getipList():
     iplist = []
@@ -267,85 +464,93 @@ def argonsysinfo_getipList():
     return iplist
 
 def argonsysinfo_getrootdev():
-    command = os.popen('mount')
-    tmp = command.read()
-    command.close()
-    alllines = tmp.split("\n")
+    return argoninventory_get().rootdev
 
-    for temp in alllines:
-        temp = temp.replace('\t', ' ')
-        temp = temp.strip()
-        while temp.find("  ") >= 0:
-            temp = temp.replace("  ", " ")
-        infolist = temp.split(" ")
-        if len(infolist) >= 3:
+#
+def argonsysinfo_listmounts():
+    """ Generate (major:minor, mount point, source) for every mount in /proc/self/mountinfo.  The
+    mount point has its octal escapes (\\040 for a space etc) decoded.
+    """
+    for line in argonprocfs_reader("/proc/self/mountinfo").lines():
+        fields = argonparse_fields(line)
+        try:
+            # Optional fields end with a lone "-", followed by the fs type and the source
+            sep = fields.index(b"-", 6)
+            source = fields[sep+2]
+        except (ValueError, IndexError):
+            continue
+        mountpoint = os.fsdecode(codecs.escape_decode(fields[4])[0])
+        yield (fields[2].decode(), mountpoint, os.fsdecode(source))
 
-            if infolist[2] == "/":
-                return infolist[0]
-    return ""
+#
+def argonsysinfo_getblockdev( devnum, source = "" ):
+    """ Resolve a "major:minor" device number to the block device through sysfs.  This handles
+    /dev/root and /dev/mapper/* without having to ask mount.  Returns a tuple of (disk, device, mapper)
+    where disk is the whole disk a partition lives on and mapper the dm-N name of a device mapper
+    device, or None if it is not a block device.
+    """
+    sysdev = "/sys/dev/block/" + devnum
+    if not os.path.exists(sysdev) and source.startswith("/dev/"):
+        # Some filesystems (btrfs for one) report an anonymous device number, use the source instead
+        try:
+            rdev = os.stat(source).st_rdev
+            sysdev = "/sys/dev/block/" + str(os.major(rdev)) + ":" + str(os.minor(rdev))
+        except OSError:
+            return None
+    try:
+        devpath = os.path.realpath(sysdev)
+        if not os.path.isdir(devpath):
+            return None
+        devname = os.path.basename(devpath)
+        if os.path.exists(devpath + "/partition"):
+            return (os.path.basename(os.path.dirname(devpath)), devname, None)
+        if os.path.exists(devpath + "/dm/name"):
+            with open(devpath + "/dm/name") as dmname:
+                return (dmname.read().strip(), devname, devname)
+        return (devname, devname, None)
+    except OSError:
+        return None
 
 def argonsysinfo_listhddusage():
+    """ Report used/total (in KB) and percent used for every disk with a mounted filesystem.  All
+    partitions on a disk are added together, RAID arrays are reported as the md device.  We read
+    /proc/self/mountinfo and call statvfs on each mount, so no processes are spawned.
+    """
     outputobj = {}
-    raidlist = argonsysinfo_listraid()
-    raiddevlist = []
-    raidctr = 0
-    while raidctr < len(raidlist['raidlist']):
-        raiddevlist.append(raidlist['raidlist'][raidctr]['title'])
-        raidctr = raidctr + 1
+    seen = set()
+    inventory = argoninventory_get()
 
-    rootdev = argonsysinfo_getrootdev()
+    for devnum, mountpoint, source in argonsysinfo_listmounts():
+        if devnum in seen:
+            # Bind mounts etc, only count each filesystem once
+            continue
+        device = inventory.devnums.get(devnum)
+        if device is None and source.startswith("/dev/"):
+            blockdev = argonsysinfo_getblockdev(devnum, source)
+            if blockdev is not None:
+                device = inventory.devices.get(blockdev[1])
+        if device is None or not device.storage:
+            continue
+        seen.add(devnum)
+        curdev = device.disk
+        mapper = device.mapper
+        try:
+            stats = os.statvfs(mountpoint)
+        except OSError:
+            continue
+        total = (stats.f_blocks * stats.f_frsize) >> 10
+        used = ((stats.f_blocks - stats.f_bfree) * stats.f_frsize) >> 10
+        if total == 0:
+            continue
 
-    command = os.popen('df')
-    tmp = command.read()
-    command.close()
-    alllines = tmp.split("\n")
+        if curdev not in outputobj:
+            outputobj[curdev] = {"used":0, "total":0, "percent":0}
+            if  mapper:
+                outputobj[curdev]["mapper"] = mapper
 
-    for temp in alllines:
-        temp = temp.replace('\t', ' ')
-        temp = temp.strip()
-        while temp.find("  ") >= 0:
-            temp = temp.replace("  ", " ")
-        infolist = temp.split(" ")
-        if len(infolist) >= 6:
-            if infolist[1] == "Size":
-                continue
-            if len(infolist[0]) < 5:
-                continue
-            elif infolist[0][0:5] != "/dev/":
-                continue
-            curdev = infolist[0]
-            mapper = None
-            if curdev.startswith('/dev/mapper/'):
-                from pathlib import Path
-                mapper = Path(curdev).readlink().name
-
-            if curdev == "/dev/root" and rootdev != "":
-                curdev = rootdev
-
-            tmpidx = curdev.rfind("/")
-            if tmpidx >= 0:
-                curdev = curdev[tmpidx+1:]
-            #
-            # Throw out all devices being used by raid
-            #
-            if curdev in raidlist['hddlist']:
-                continue
-            elif curdev not in raiddevlist and not mapper:
-              if curdev[0:2] == "sd" or curdev[0:2] == "hd":
-                  curdev = curdev[0:-1]
-              else:
-                  curdev = curdev[0:-2]
-                  
-            percent=infolist[4].split("%")[0]
-            if curdev not in outputobj:
-                outputobj[curdev] = {"used":0, "total":0, "percent":0}
-                if  mapper:
-                    outputobj[curdev]["mapper"] = mapper
-
-            outputobj[curdev]["used"]         += int(infolist[2])
-            outputobj[curdev]["total"]        += int(infolist[1])
-            outputobj[curdev]["percent"]       = round(((outputobj[curdev]["used"]/outputobj[curdev]["total"]) * 100),1)
-            #outputobj[curdev]["percent"]      += int(percent)
+        outputobj[curdev]["used"]         += used
+        outputobj[curdev]["total"]        += total
+        outputobj[curdev]["percent"]       = round(((outputobj[curdev]["used"]/outputobj[curdev]["total"]) * 100),1)
     
     return outputobj
 
@@ -368,25 +573,19 @@ def argonsysinfo_kbstr(kbval, wholenumbers = True):
         kbval = kbval + 1
     return str(kbval)+remainderstr + suffixlist[suffixidx]
 
-def argonsysinfo_listraid():
+def argonsysinfo_listraid(detail = False):
     hddlist = []
     outputlist = []
     # cat /proc/mdstat
     # multiple mdxx from mdstat
-    # mdadm -D /dev/md1
+    # details from /sys/block/mdxx/md, or mdadm -D /dev/mdxx if detail is requested
 
     ramtotal = 0
     errorflag = False
     try:
         hddctr = 0
-        tempfp = open("/proc/mdstat", "r")
-        alllines = tempfp.readlines()
-        for temp in alllines:
-            temp = temp.replace('\t', ' ')
-            temp = temp.strip()
-            while temp.find("  ") >= 0:
-                temp = temp.replace("  ", " ")
-            infolist = temp.split(" ")
+        for line in argonprocfs_reader("/proc/mdstat").lines():
+            infolist = [field.decode() for field in argonparse_fields(line)]
             if len(infolist) >= 4:
 
                 # Check if raid info
@@ -402,10 +601,8 @@ def argonsysinfo_listraid():
                             tmpdevname = tmpdevname[0:tmpidx]
                         hddlist.append(tmpdevname)
                         hddctr = hddctr + 1
-                    devdetail = argonsysinfo_getraiddetail(devname)
+                    devdetail = argonsysinfo_getraiddetail(devname, detail)
                     outputlist.append({"title": devname, "value": raidtype, "info": devdetail})
-
-        tempfp.close()
     except IOError:
         # No raid
         errorflag = True
@@ -413,7 +610,87 @@ def argonsysinfo_listraid():
     return {'raidlist': outputlist, 'hddlist': hddlist}
 
 
-def argonsysinfo_getraiddetail(devname):
+def argonsysinfo_readsysfs( path ):
+    """ Read a single value sysfs attribute, returning an empty string if it cannot be read.
+    """
+    try:
+        return argonprocfs_reader( path ).readstr()
+    except (IOError, UnicodeDecodeError):
+        argonprocfs_forget( path )
+        return ""
+
+#
+# How mdadm describes each md sync_action in its State line
+#
+mdsyncstates = {"resync": "resyncing", "recover": "recovering", "check": "checking",
+                "repair": "repairing", "reshape": "reshaping"}
+
+#
+def argonsysinfo_getraiddetail( devname, detail = False ):
+    """ Return the details of a RAID array.  Everything is read from /sys/block/<devname>/md, unless
+    detail is requested, in which case we ask mdadm.
+    """
+    if detail:
+        return argonsysinfo_getmdadmdetail( devname )
+
+    mdpath = "/sys/block/" + devname + "/md/"
+    raidtype = argonsysinfo_readsysfs( mdpath + "level" )
+    arraystate = argonsysinfo_readsysfs( mdpath + "array_state" )
+    syncaction = argonsysinfo_readsysfs( mdpath + "sync_action" )
+    synccompleted = argonsysinfo_readsysfs( mdpath + "sync_completed" )
+
+    #
+    # Build the state the way mdadm reports it, i.e. "clean, degraded, recovering"
+    #
+    if arraystate == "clean" or arraystate == "inactive" or arraystate.startswith( "read" ):
+        statelist = [arraystate]
+    else:
+        statelist = ["active"]
+    try:
+        if int( argonsysinfo_readsysfs( mdpath + "degraded" ) ) > 0:
+            statelist.append( "degraded" )
+    except ValueError:
+        ...
+    if syncaction in mdsyncstates:
+        statelist.append( mdsyncstates[syncaction] )
+
+    resync = ""
+    if syncaction in mdsyncstates and "/" in synccompleted:
+        done, total = synccompleted.split( "/" )
+        if int(total) > 0:
+            resync = str( int(100*int(done)/int(total)) ) + "% complete"
+
+    total = 0
+    active = 0
+    working = 0
+    failed = 0
+    hddlist = []
+    try:
+        members = sorted( [d for d in os.listdir( mdpath ) if d.startswith( "dev-" )] )
+    except OSError:
+        members = []
+    for member in members:
+        memberstate = argonsysinfo_readsysfs( mdpath + member + "/state" ).split( "," )
+        total = total + 1
+        if "faulty" in memberstate:
+            failed = failed + 1
+        else:
+            working = working + 1
+        if "in_sync" in memberstate:
+            active = active + 1
+        hddlist.append( "/dev/" + member[4:] )
+
+    try:
+        size = int( argonsysinfo_readsysfs( "/sys/block/" + devname + "/size" ) ) >> 1
+    except ValueError:
+        size = 0
+    try:
+        used = int( argonsysinfo_readsysfs( mdpath + "component_size" ) )
+    except ValueError:
+        used = 0
+    return {'state': ", ".join(statelist), 'raidtype': raidtype, 'size': size, 'used': used, 'devices': total, 'active': active, 'working': working, 'failed': failed, 'spare': working - active, 'resync': resync, 'hddlist':hddlist}
+
+def argonsysinfo_getmdadmdetail(devname):
     state = ""
     raidtype = ""
     size = 0
@@ -434,79 +711,331 @@ def argonsysinfo_getraiddetail(devname):
     alllines = tmp.split("\n")
 
     for temp in alllines:
-        temp = temp.replace('\t', ' ')
-        temp = temp.strip()
-        while temp.find("  ") >= 0:
-            temp = temp.replace("  ", " ")
-        infolist = temp.split(" : ")
-        if len(infolist) == 2:
-            if infolist[0].lower() == "raid level":
+        infolist = argonparse_keyvalue(temp)
+        if infolist is not None:
+            if infolist[0] == "raid level":
                 raidtype = infolist[1]
-            elif infolist[0].lower() == "array size":
+            elif infolist[0] == "array size":
                 tmpidx = infolist[1].find(" ")
                 if tmpidx > 0:
                     size = (infolist[1][0:tmpidx])
-            elif infolist[0].lower() == "used dev size":
+            elif infolist[0] == "used dev size":
                 tmpidx = infolist[1].find(" ")
                 if tmpidx > 0:
                     used = (infolist[1][0:tmpidx])
-            elif infolist[0].lower() == "state":
+            elif infolist[0] == "state":
                 state = infolist[1]
-            elif infolist[0].lower() == "total devices":
+            elif infolist[0] == "total devices":
                 total = infolist[1]
-            elif infolist[0].lower() == "active devices":
+            elif infolist[0] == "active devices":
                 active = infolist[1]
-            elif infolist[0].lower() == "working devices":
+            elif infolist[0] == "working devices":
                 working = infolist[1]
-            elif infolist[0].lower() == "failed devices":
+            elif infolist[0] == "failed devices":
                 failed = infolist[1]
-            elif infolist[0].lower() == "spare devices":
+            elif infolist[0] == "spare devices":
                 spare = infolist[1]
-            elif infolist[0].lower() == "rebuild status":
+            elif infolist[0] == "rebuild status":
                 resync = infolist[1]
-            elif infolist[0].lower() == "resync status":
+            elif infolist[0] == "resync status":
                 resync = infolist[1]
-            elif infolist[0].lower() == "check status":
+            elif infolist[0] == "check status":
                 resync = infolist[1]
-        elif len(infolist) > 0:
-            infolist = temp.split(" ")
+        else:
+            infolist = argonparse_fields(temp)
             if len(infolist) == 7:
                 hddlist.append(infolist[6])
     return {'state': state, 'raidtype': raidtype, 'size': int(size), 'used': int(used), 'devices': int(total), 'active': int(active), 'working': int(working), 'failed': int(failed), 'spare': int(spare), 'resync': resync, 'hddlist':hddlist}
 
-def argonsysinfo_diskusagedetail( disk,mapper : str = None ):
-    readsector = 0
-    writesector = 0
-    discardsector = 0
+#
+# md attributes that sysfs_notify() when they change
+#
+mdwatchattributes = ["array_state", "degraded", "sync_action"]
 
-    if mapper:
-        this = mapper
-    else:
-        this = disk
-    command = os.popen( "cat /sys/block/" + this + "/stat" )
-    tmp = command.read()
-    command.close()
-    tmp.replace('\t',' ')
-    tmp = tmp.strip()
-    while tmp.find("  ") >= 0:
-        tmp = tmp.replace("  ", " ")
-    data = tmp.split(" ")
-    if len(data) >= 11:
-        readsector = data[2]
-        writesector = data[6]
-
-    return {'disk':disk, 'readsector':int(readsector), 'writesector':int(writesector)}
-
-def argonsysinfo_diskusage():
-    usage = []
-    hddlist = argonsysinfo_listhddusage()
-    for disk in hddlist:
-        parms = {"disk" : disk}
-        if "mapper" in hddlist[disk]:
-            parms["mapper"] = hddlist[disk]["mapper"]
-        temp = argonsysinfo_diskusagedetail( **parms )
-        usage.append( temp )
-    return usage
+#
+# array_state values md moves between on ordinary writes, which say nothing about the health of
+# the array
+#
+mdrunningstates = {"clean", "active", "active-idle", "write-pending"}
+
+#
+class RaidWatcher( threading.Thread ):
+    """
+    Wait for md RAID state changes without polling.  The md driver notifies array_state, degraded
+    and sync_action (and /proc/mdstat itself) when they change, which wakes up poll() with POLLPRI.
+    Most of those wake ups are array_state going between clean and active as the array is written
+    to, so onchange is only called, with the result of argonsysinfo_listraid(), when the condition
+    of an array (see condition()) changes or arrays come or go.
+    """
+    def __init__( self, onchange ):
+        super().__init__( name = "raidwatcher", daemon = True )
+        self.onchange  = onchange
+        self.watched   = {}
+        self.condition = {}
+
+    def watch( self, path ):
+        reader = ProcFile( path )
+        try:
+            # Reading records the current event count, so only later changes wake us up
+            value = bytes( reader.read() )
+        except IOError:
+            return
+        self.watched[path] = (reader, value)
+
+    def rewatch( self ):
+        """ (Re)open everything we watch, called at startup and whenever /proc/mdstat changes.
+        """
+        for reader, value in self.watched.values():
+            reader.close()
+        self.watched = {}
+        self.watch( "/proc/mdstat" )
+        for devname in argonsysinfo_listmdarrays():
+            for attribute in mdwatchattributes:
+                self.watch( "/sys/block/" + devname + "/md/" + attribute )
+
+    def conditions( self ):
+        """ The condition of each watched array, keyed by array name: its array_state (with all the
+        states of a working array folded into "running"), degraded count and sync_action.
+        """
+        conditions = {}
+        for path, (reader, value) in self.watched.items():
+            if not path.startswith( "/sys/block/" ):
+                continue
+            parts = path.split( "/" )
+            devname, attribute = parts[3], parts[5]
+            value = value.decode( errors = "replace" ).strip()
+            if attribute == "array_state" and value in mdrunningstates:
+                value = "running"
+            conditions.setdefault( devname, {} )[attribute] = value
+        return conditions
+
+    def run( self ):
+        self.rewatch()
+        self.condition = self.conditions()
+        while True:
+            poller = select.poll()
+            paths = {}
+            for path, (reader, value) in self.watched.items():
+                # The reader may have reopened its file, so register whatever descriptor it has now
+                paths[reader.fd] = path
+                poller.register( reader.fd, select.POLLPRI | select.POLLERR )
+            rescan = False
+            if len(self.watched) == 0:
+                # md is not loaded yet, check back every few minutes
+                time.sleep( 300 )
+                rescan = True
+            for fd, event in poller.poll( None if len(self.watched) > 0 else 0 ):
+                path = paths[fd]
+                reader, value = self.watched[path]
+                try:
+                    newvalue = bytes( reader.read() )
+                except IOError:
+                    # The array went away
+                    rescan = True
+                    continue
+                if newvalue != value:
+                    self.watched[path] = (reader, newvalue)
+                    if path == "/proc/mdstat":
+                        rescan = True
+            if rescan:
+                self.rewatch()
+            condition = self.conditions()
+            if condition != self.condition:
+                self.condition = condition
+                try:
+                    self.onchange( argonsysinfo_listraid() )
+                except Exception:
+                    ...
+
+#
+def argonsysinfo_listmdarrays():
+    """ Return the names of the md arrays listed in /proc/mdstat.
+    """
+    arrays = []
+    try:
+        for line in argonprocfs_reader("/proc/mdstat").lines():
+            infolist = argonparse_fields(line)
+            if len(infolist) >= 2 and infolist[1] == b":" and infolist[0] != b"Personalities":
+                arrays.append(infolist[0].decode())
+    except IOError:
+        ...
+    return arrays
+
+diskstatsfields = FieldExtractor([2, 3, 5, 6, 7, 9, 10, 11, 12, 13])
+
+#
+def argonsysinfo_diskstats():
+    """ Read the I/O counters for every block device from a single pass over /proc/diskstats.  The
+    result is keyed by the kernel device name (sda, mmcblk0, md0, dm-0 ...).  Sector counts are in
+    512 byte sectors, and the tick counts in milliseconds.
+    """
+    output = {}
+    try:
+        for line in argonprocfs_reader("/proc/diskstats").lines():
+            data = diskstatsfields.extract(line)
+            if data is None:
+                continue
+            output[data[0].decode()] = {'reads'         : int(data[1]),
+                                        'readsector'    : int(data[2]),
+                                        'readticks'     : int(data[3]),
+                                        'writes'        : int(data[4]),
+                                        'writesector'   : int(data[5]),
+                                        'writeticks'    : int(data[6]),
+                                        'inflight'      : int(data[7]),
+                                        'ioticks'       : int(data[8]),
+                                        'weightedticks' : int(data[9])}
+    except IOError:
+        ...
+    return output
+
+#
+def argonsysinfo_netdev():
+    """ Read the byte and packet counters of every interface we report on, from a single pass over
+    /proc/net/dev.  Returns a dictionary of interface name to (rx bytes, tx bytes, rx packets,
+    tx packets).
+    """
+    output = {}
+    try:
+        for line in argonprocfs_reader("/proc/net/dev").lines():
+            # "  eth0: rxbytes rxpackets ... txbytes txpackets ...", the header lines have no colon
+            name, sep, counters = line.tobytes().partition(b":")
+            if not sep:
+                continue
+            name = name.strip().decode()
+            fields = argonparse_fields(counters)
+            if len(fields) < 10 or not argonsysinfo_showinterface(name):
+                continue
+            output[name] = (int(fields[0]), int(fields[8]), int(fields[1]), int(fields[9]))
+    except IOError:
+        ...
+    return output
+
+#
+def argonsysinfo_diskcounters( diskstats = None ):
+    """ Just the counters the I/O sampler tracks, taken from argonsysinfo_diskstats() (which is read
+    if diskstats is not given), device name to (sectors read, sectors written, reads, writes,
+    read ms, write ms, busy ms, weighted busy ms).
+    """
+    if diskstats is None:
+        diskstats = argonsysinfo_diskstats()
+    return {name: (stats['readsector'], stats['writesector'], stats['reads'], stats['writes'],
+                   stats['readticks'], stats['writeticks'], stats['ioticks'], stats['weightedticks'])
+            for name, stats in diskstats.items()}
+
+#
+def argonsysinfo_diskmetrics( rate ):
+    """ Work out the usual iostat figures from the per second rates of the diskstats counters.
+    Returns (IOPS, average ms per I/O (await), average queue depth, percent busy).
+    """
+    readsector, writesector, reads, writes, readms, writems, busyms, weightedms = rate
+    iops = reads + writes
+    latency = 0
+    if iops > 0:
+        latency = (readms + writems)/iops
+    # Time is counted in ms, so ms per second / 1000 is the queue depth, and / 10 the percentage
+    return (iops, latency, weightedms/1000, min( 100, busyms/10 ))
+
+#
+class IORateSampler( threading.Thread ):
+    """
+    Background thread that reads the block device and the network interface counters together
+    every interval seconds, and keeps their rates.  The rates are exponentially weighted moving
+    averages with a time constant of tau seconds, so they follow a transfer quickly but do not
+    jump about with every burst.  The last argonsysinfo_diskstats() read is kept as diskstats, so
+    everything else that wants the raw counters can use it rather than read them again.
+    """
+    def __init__( self, interval = 1, tau = 5, publish = True ):
+        super().__init__( name = "iosampler", daemon = True )
+        self.interval = interval
+        self.publish  = publish
+        self.disks    = RateTracker( 8, tau )
+        self.network  = RateTracker( 4, tau )
+        self.diskstats = None
+
+    def sample( self ):
+        now = time.monotonic()
+        diskstats = argonsysinfo_diskstats()
+        self.disks.update( argonsysinfo_diskcounters( diskstats ), now )
+        self.diskstats = diskstats
+        self.network.update( argonsysinfo_netdev(), now )
+
+    def run( self ):
+        while True:
+            self.sample()
+            if self.publish:
+                argonsysinfo_publish( iorates, self.rates() )
+            time.sleep( self.interval )
+
+    def rates( self ):
+        """ Return the averaged rates, per second, as
+            {'disks'  : {device: [sectors read, sectors written, reads, writes, read ms, write ms,
+                                  busy ms, weighted busy ms]},
+             'network': {interface: [rx bytes, tx bytes, rx packets, tx packets]}}
+        """
+        return {'disks'  : {name: list(rate) for name, rate in self.disks.averages.items()},
+                'network': {name: list(rate) for name, rate in self.network.averages.items()}}
+
+iosampler = None
+
+#
+def argonsysinfo_startiosampler( interval = 1 ):
+    """ Start the background I/O sampler, if it is not already running.  The sampler publishes its
+    results for argon-status.
+    """
+    global iosampler
+    if iosampler is None:
+        iosampler = IORateSampler( interval )
+        iosampler.start()
+    return iosampler
+
+#
+def argonsysinfo_getiorates( sleepsec = 1 ):
+    """ Return the disk and interface rates from the background sampler, either the one running in
+    this process or the one published by the daemon.  If neither is available the counters are
+    read twice, sleepsec seconds apart.
+    """
+    if iosampler is not None:
+        return iosampler.rates()
+    rates = argonsysinfo_readpublished( iorates, 5 )
+    if rates is None:
+        sampler = IORateSampler( publish = False )
+        sampler.sample()
+        time.sleep( sleepsec )
+        sampler.sample()
+        rates = sampler.rates()
+    return rates
+
+#
+def argonsysinfo_listdiskbusy():
+    """ Percent busy for each whole storage device, from the I/O sampler """
+    rates = argonsysinfo_getiorates()['disks']
+    output = {}
+    for device in argoninventory_get().devices.values():
+        if device.storage and not device.partition and device.name in rates:
+            output[device.name] = argonsysinfo_diskmetrics( rates[device.name] )[3]
+    return output
+
+loadmonitor = None
+
+#
+def argonsysinfo_startloadmonitor( onsample = None ):
+    """ Start following the system load (PSI and disk busy time), if we are not already.  onsample
+    is handed the load after every sample.
+    """
+    global loadmonitor
+    if loadmonitor is None:
+        loadmonitor = LoadMonitor( argonsysinfo_listdiskbusy, onsample = onsample )
+        loadmonitor.start()
+    return loadmonitor
+
+#
+def argonsysinfo_getload():
+    """ Return the load status from the monitor in this process, or take a single sample """
+    if loadmonitor is not None:
+        return loadmonitor.status()
+    monitor = LoadMonitor( argonsysinfo_listdiskbusy )
+    monitor.sample()
+    return monitor.status()
 
 def argonsysinfo_truncateFloat( value, dp ):
     """ make sure the value passed in has no more decimal places than the
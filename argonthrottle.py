@@ -0,0 +1,164 @@
+#!/usr/bin/python3
+
+#
+# CPU throttling monitor.
+#
+# The firmware drops the ARM clock once the SoC gets too hot (or the supply voltage sags), and it
+# does so before our CPUFan curve necessarily reaches full speed.  The firmware driver reports its
+# throttling flags in sysfs, and cpufreq reports the clock we are actually running at, so both are
+# sampled every second and the fan thread is told as soon as throttling starts, or is about to.
+#
+
+import time
+import threading
+from collections import deque
+from argonprocfs import *
+from argonlogging import *
+
+THROTTLED_PATH = "/sys/devices/platform/soc/soc:firmware/get_throttled"
+CPUFREQ_PATH   = "/sys/devices/system/cpu/cpu0/cpufreq/scaling_cur_freq"
+CPUTEMP_PATH   = "/sys/class/thermal/thermal_zone0/temp"
+
+#
+# The "currently" bits of get_throttled, the same bits shifted up by 16 are the "has occurred
+# since boot" versions.
+#
+THROTTLE_REASONS = {0x1: "undervoltage", 0x2: "capped", 0x4: "throttled", 0x8: "softlimit"}
+THROTTLE_ACTIVE  = 0x2 | 0x4
+THROTTLE_WARNING = 0x8
+
+#
+# How far (in C) the CPU has to drop below warntemp before a temperature warning is cleared, so a
+# CPU sitting right at warntemp does not flap between ok and warning
+#
+WARN_CLEARBAND = 2.0
+
+#
+def argonthrottle_readflags():
+    """
+    Return the current get_throttled flags, or None if the firmware does not report them.
+    """
+    try:
+        return int( argonprocfs_reader( THROTTLED_PATH ).readstr(), 16 )
+    except (OSError, ValueError):
+        return None
+
+#
+def argonthrottle_readfreq():
+    """
+    Return the current ARM clock in MHz, or 0 if cpufreq is not available.
+    """
+    try:
+        return argonprocfs_reader( CPUFREQ_PATH ).readint() // 1000
+    except (OSError, ValueError):
+        return 0
+
+#
+def argonthrottle_readtemp():
+    try:
+        return argonprocfs_reader( CPUTEMP_PATH ).readint() / 1000
+    except (OSError, ValueError):
+        return 0
+
+#
+def argonthrottle_reasons( flags ):
+    """ The names of the "currently" bits that are set """
+    return [THROTTLE_REASONS[bit] for bit in sorted( THROTTLE_REASONS ) if flags & bit]
+
+#
+class ThrottleMonitor( threading.Thread ):
+    """
+    Sample the throttling flags, the ARM clock and the CPU temperature (temp) every interval seconds.
+
+        state  - "ok", "warning" when the soft temperature limit is active or the CPU is at or over
+                 warntemp (throttling is about to start), or "throttled" when the clock is capped
+                 or throttled.  A temperature warning lasts until the CPU is WARN_CLEARBAND below
+                 warntemp.
+        events - the most recent throttling episodes, each a dictionary of start (time.time()),
+                 duration (seconds), reasons and the lowest clock (MHz) seen
+
+    warntemp is either a temperature, or a callable returning it, which is called on every sample
+    so a configuration change is picked up.  onchange is called with the new state whenever the
+    state changes, and onsample with the summary from status() after every sample.
+    """
+    def __init__( self, interval = 1, warntemp = 75.0, onchange = None, onsample = None, depth = 20 ):
+        super().__init__( name = "throttle", daemon = True )
+        self.interval = interval
+        self.warntemp = warntemp
+        self.onchange = onchange
+        self.onsample = onsample
+        self.state    = "ok"
+        self.flags    = 0
+        self.freq     = 0
+        self.temp     = 0
+        self.current  = None
+        self.events   = deque( maxlen = depth )
+        self.count    = 0
+        self.seconds  = 0.0
+
+    def sample( self ):
+        flags = argonthrottle_readflags()
+        self.flags = flags or 0
+        self.freq  = argonthrottle_readfreq()
+        self.temp  = argonthrottle_readtemp()
+        warntemp = self.warntemp
+        if callable( warntemp ):
+            warntemp = warntemp()
+        if self.state != "ok":
+            warntemp -= WARN_CLEARBAND
+        if self.flags & THROTTLE_ACTIVE:
+            state = "throttled"
+        elif self.flags & THROTTLE_WARNING or self.temp >= warntemp:
+            state = "warning"
+        else:
+            state = "ok"
+
+        now = time.time()
+        if state == "throttled":
+            if self.current is None:
+                self.current = {'start': now, 'duration': 0, 'reasons': [], 'minfreq': self.freq}
+                self.count += 1
+            self.current['duration'] = now - self.current['start']
+            self.current['minfreq']  = min( self.current['minfreq'], self.freq )
+            for reason in argonthrottle_reasons( self.flags ):
+                if reason not in self.current['reasons']:
+                    self.current['reasons'].append( reason )
+        elif self.current is not None:
+            self.current['duration'] = now - self.current['start']
+            self.seconds += self.current['duration']
+            self.events.append( self.current )
+            self.current = None
+
+        changed = state != self.state
+        self.state = state
+        return changed
+
+    def status( self ):
+        """ Everything we know, as a dictionary that can be published """
+        events = list( self.events )
+        seconds = self.seconds
+        if self.current is not None:
+            events.append( dict( self.current ) )
+            seconds += self.current['duration']
+        return {'state'   : self.state,
+                'flags'   : self.flags,
+                'freq'    : self.freq,
+                'temp'    : self.temp,
+                'count'   : self.count,
+                'seconds' : seconds,
+                'events'  : events}
+
+    def run( self ):
+        while True:
+            changed = self.sample()
+            if changed and self.onchange is not None:
+                try:
+                    self.onchange( self.state )
+                except Exception as e:
+                    logError( "Error handling the throttle state change to " + self.state + ": " + str(e) )
+            if self.onsample is not None:
+                try:
+                    self.onsample( self.status() )
+                except Exception as e:
+                    logError( "Error handling a throttle sample: " + str(e) )
+            time.sleep( self.interval )